@@ -4,27 +4,169 @@
 Находит оптимальные комбинации перелетов с учетом стоимости и времени пребывания.
 """
 
+import io
+import sys
+import gzip
 import json
+import heapq
 import argparse
 import subprocess
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Tuple, Set
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Tuple, Set, Optional, NamedTuple, Iterator, BinaryIO
 from pathlib import Path
-from collections import defaultdict
+from bisect import bisect_left
+from functools import lru_cache, partial
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него используем стандартный json
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # ijson необязателен, без него большие файлы читаются целиком
+    ijson = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard необязателен, без него не читаются только файлы .zst
+    zstandard = None
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен, без него пары перебираются на чистом Python
+    np = None
+
+try:
+    import numba
+except ImportError:  # numba необязательна, без нее используется векторизованный перебор NumPy
+    numba = None
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Файлы крупнее этого размера читаются потоково (если установлен ijson)
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# Начиная с такого числа пар перебор компилируется numba (компиляция стоит секунды)
+JIT_MIN_PAIRS = 20_000_000
+
+# Максимальный размер блока пар, который NumPy обрабатывает за одну операцию
+NUMPY_BLOCK_PAIRS = 1_000_000
+
+# Начиная с такого числа комбинаций медиана ищется через np.argpartition
+MEDIAN_PARTITION_MIN = 10_000
+
+
+class Flight(NamedTuple):
+    """Рейс с заранее вычисленными полями, которые нужны при поиске комбинаций."""
+    origin: Optional[str]
+    destination: Optional[str]
+    departure_at: Optional[str]
+    arrival_at: Optional[str]
+    price: float
+    airline: Optional[str]
+    flight_number: Optional[str]
+    link: Optional[str]
+    duration: Optional[int]
+    departure_seconds: Optional[int]
+    arrival_seconds: Optional[int]
+
+
+def json_loads(raw: bytes) -> Any:
+    """
+    Разбирает JSON из байтов, используя orjson, если он установлен.
+
+    Args:
+        raw: Содержимое JSON файла
+
+    Returns:
+        Разобранные данные
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def json_dumps(obj: Any) -> bytes:
+    """
+    Сериализует данные в JSON с отступом в 2 пробела, используя orjson, если он установлен.
+
+    Args:
+        obj: Данные для сериализации
+
+    Returns:
+        JSON в кодировке UTF-8
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def open_data_file(file_path: str) -> BinaryIO:
+    """
+    Открывает файл с данными на чтение, распаковывая файлы .gz и .zst.
+
+    Args:
+        file_path: Путь к файлу
+
+    Returns:
+        Файловый объект для чтения
+    """
+    suffix = Path(file_path).suffix
+    if suffix == ".gz":
+        return gzip.open(file_path, 'rb')
+    if suffix == ".zst":
+        if zstandard is None:
+            raise ImportError("Для чтения файлов .zst установите пакет zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'))
+    return open(file_path, 'rb')
+
+
+def iter_json_items(file_path: str, prefix: str) -> Iterator[Any]:
+    """
+    Потоково читает элементы JSON файла по префиксу ijson, не загружая файл целиком.
+
+    Args:
+        file_path: Путь к JSON файлу
+        prefix: Префикс ijson, например "leg1_flights.item"
+
+    Yields:
+        Элементы, найденные по префиксу
+    """
+    with open_data_file(file_path) as f:
+        yield from ijson.items(f, prefix, use_float=True)
 
 
 def load_data(file_path: str) -> Dict[str, Any]:
     """
     Загружает данные из JSON файла.
 
+    Большие файлы при установленном ijson читаются потоково: вместо списков
+    рейсов возвращаются итераторы, и в памяти не держится все дерево JSON.
+
     Args:
         file_path: Путь к файлу с данными
 
     Returns:
         Словарь с данными о перелетах
     """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    data_path = Path(file_path)
+
+    if ijson is not None and data_path.stat().st_size > STREAMING_THRESHOLD_BYTES:
+        # collect_flights.py пишет метаданные в начало файла, поэтому для них
+        # разбирается только начало файла, а не весь файл
+        metadata_items = iter_json_items(file_path, "metadata")
+        metadata = next(metadata_items, {})
+        metadata_items.close()
+        return {
+            "metadata": metadata,
+            "leg1_flights": iter_json_items(file_path, "leg1_flights.item"),
+            "leg2_flights": iter_json_items(file_path, "leg2_flights.item")
+        }
+
+    # Читаем файл целиком в байты: парсер получает весь буфер сразу, без построчного декодирования
+    with open_data_file(file_path) as f:
+        return json_loads(f.read())
 
 
 def load_airport_network(network_file: str = "data/airport_network.json") -> Dict[str, Dict]:
@@ -65,8 +207,7 @@ def load_airport_network(network_file: str = "data/airport_network.json") -> Dic
             return {}
 
     try:
-        with open(network_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return json_loads(network_path.read_bytes())
     except Exception as e:
         print(f"Ошибка при загрузке сети аэропортов: {e}")
         return {}
@@ -145,6 +286,36 @@ def get_nearby_airports(airport_iata: str, network: Dict[str, Dict],
     return nearby
 
 
+def _parse_iso_fast(date_str: str) -> datetime:
+    """
+    Быстрый разбор строки вида YYYY-MM-DDTHH:MM:SS[+HH:MM] или YYYY-MM-DD
+    срезами строки, без strptime. Часовой пояс отбрасывается.
+
+    Args:
+        date_str: Строка с датой в ISO формате
+
+    Returns:
+        Объект datetime
+
+    Raises:
+        ValueError: Если строка не соответствует ожидаемому формату
+    """
+    if date_str[4] != '-' or date_str[7] != '-':
+        raise ValueError(date_str)
+
+    year, month, day = int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10])
+    length = len(date_str)
+    if length == 10:
+        return datetime(year, month, day)
+
+    if length >= 19 and date_str[10] in 'T ' and (length == 19 or date_str[19] in '+-'):
+        return datetime(year, month, day,
+                        int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19]))
+
+    raise ValueError(date_str)
+
+
+@lru_cache(maxsize=4096)
 def parse_datetime(date_str: str) -> datetime:
     """
     Парсит дату и время из ISO формата.
@@ -155,15 +326,29 @@ def parse_datetime(date_str: str) -> datetime:
     Returns:
         Объект datetime
     """
+    # Основной формат API разбираем без strptime
+    try:
+        return _parse_iso_fast(date_str)
+    except (ValueError, IndexError):
+        pass
+
+    # Убираем timezone для простоты: обрезаем строку по '+' и по третьему
+    # дефису (отрицательное смещение), не создавая промежуточных списков
+    date_clean = date_str
+    plus = date_clean.find('+')
+    if plus != -1:
+        date_clean = date_clean[:plus]
+    hyphen = -1
+    for _ in range(3):
+        hyphen = date_clean.find('-', hyphen + 1)
+        if hyphen == -1:
+            break
+    else:
+        date_clean = date_clean[:hyphen]
+
     # Обрабатываем разные форматы дат
     for fmt in ["%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"]:
         try:
-            # Убираем timezone для простоты
-            date_clean = date_str.split('+')[0].split('-', 3)
-            if len(date_clean) == 4:
-                date_clean = '-'.join(date_clean[:3])
-            else:
-                date_clean = date_str.split('+')[0]
             return datetime.strptime(date_clean, fmt)
         except (ValueError, IndexError):
             continue
@@ -219,6 +404,576 @@ def calculate_stay_duration(leg1_arrival: str, leg2_departure: str) -> int:
             return 0
 
 
+def date_to_day(date_str: str) -> Optional[int]:
+    """
+    Возвращает порядковый номер дня для строки с датой так же, как это делает
+    запасной вариант calculate_stay_duration (только дата, без времени).
+
+    Args:
+        date_str: Строка с датой в ISO формате
+
+    Returns:
+        Порядковый номер дня или None, если дату не удалось разобрать
+    """
+    try:
+        date_part = date_str.split('T')[0] if 'T' in date_str else date_str
+        return datetime.strptime(date_part, "%Y-%m-%d").toordinal()
+    except Exception:
+        return None
+
+
+def datetime_to_seconds(date_str: str) -> Optional[int]:
+    """
+    Переводит дату/время в целое число секунд (от 0001-01-01), чтобы длительность
+    пребывания считалась целочисленным делением без создания timedelta.
+
+    Args:
+        date_str: Строка с датой в ISO формате
+
+    Returns:
+        Количество секунд или None, если строку не удалось разобрать
+    """
+    try:
+        moment = parse_datetime(date_str)
+    except ValueError:
+        return None
+
+    # Даты с часовым поясом считаем по старой логике calculate_stay_duration
+    if moment.tzinfo is not None:
+        return None
+
+    return moment.toordinal() * SECONDS_PER_DAY + moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+def datetime_to_utc_seconds(date_str: str) -> Optional[int]:
+    """
+    Переводит дату/время с часовым поясом в целое число секунд UTC (от 0001-01-01).
+    Разность таких значений совпадает с разностью datetime с часовым поясом
+    в calculate_stay_duration.
+
+    Args:
+        date_str: Строка с датой в ISO формате
+
+    Returns:
+        Количество секунд или None, если строку не удалось разобрать или в ней нет часового пояса
+    """
+    try:
+        moment = parse_datetime(date_str)
+    except ValueError:
+        return None
+
+    if moment.tzinfo is None:
+        return None
+
+    moment = moment.astimezone(timezone.utc)
+    return moment.toordinal() * SECONDS_PER_DAY + moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+def departure_in_range(departure_at: Optional[str], date_from: Optional[str],
+                       date_to: Optional[str]) -> bool:
+    """
+    Проверяет, попадает ли дата вылета в диапазон. Даты YYYY-MM-DD
+    сравниваются как строки по первым 10 символам departure_at.
+
+    Args:
+        departure_at: Дата/время вылета в ISO формате
+        date_from: Минимальная дата вылета (YYYY-MM-DD)
+        date_to: Максимальная дата вылета (YYYY-MM-DD)
+
+    Returns:
+        True, если фильтр не задан или дата попадает в диапазон
+    """
+    if not date_from and not date_to:
+        return True
+    if not departure_at:
+        return False
+
+    departure_date = departure_at[:10]
+    if date_from and departure_date < date_from:
+        return False
+    if date_to and departure_date > date_to:
+        return False
+    return True
+
+
+def normalize_flight(flight: Dict[str, Any]) -> Flight:
+    """
+    Приводит рейс из API к компактному виду: разрешает альтернативные поля
+    (origin/search_origin, price/value) и вычисляет время прибытия один раз.
+
+    Args:
+        flight: Рейс в формате собранных данных
+
+    Returns:
+        Объект Flight; arrival_at равно None, если время прибытия неизвестно
+    """
+    departure_at = flight.get("departure_at")
+
+    if flight.get("arrival_at"):
+        arrival_at = flight["arrival_at"]
+    elif departure_at and flight.get("duration"):
+        # Вычисляем на основе departure_at + duration
+        arrival_at = calculate_arrival(departure_at, flight["duration"])
+    else:
+        arrival_at = None
+
+    # Коды городов интернируем: одинаковые коды становятся одним объектом,
+    # и сравнения и поиск в словарях по ним проходят по идентичности
+    origin = flight.get("origin") or flight.get("search_origin")
+    destination = flight.get("destination") or flight.get("search_destination")
+
+    return Flight(
+        origin=sys.intern(origin) if origin else origin,
+        destination=sys.intern(destination) if destination else destination,
+        departure_at=departure_at,
+        arrival_at=arrival_at,
+        price=flight.get("price") or flight.get("value", 0),
+        airline=flight.get("airline"),
+        flight_number=flight.get("flight_number"),
+        link=flight.get("link"),
+        duration=flight.get("duration"),
+        departure_seconds=datetime_to_seconds(departure_at) if departure_at else None,
+        arrival_seconds=datetime_to_seconds(arrival_at) if arrival_at else None
+    )
+
+
+def build_combination(flight1: Flight, flight2: Flight, stay_days: int,
+                      airport_network: Dict[str, Dict] = None) -> Dict[str, Any]:
+    """
+    Формирует полное описание комбинации двух рейсов.
+
+    Args:
+        flight1: Рейс первого этапа
+        flight2: Рейс второго этапа
+        stay_days: Длительность пребывания в днях
+        airport_network: Сеть аэропортов для описания перехода между аэропортами
+
+    Returns:
+        Словарь с описанием комбинации
+    """
+    intermediate_city = flight1.destination
+    leg2_origin = flight2.origin
+
+    combination = {
+        "total_price": flight1.price + flight2.price,
+        "stay_days": stay_days,
+        "intermediate_city": intermediate_city,
+        "leg1": {
+            "origin": flight1.origin,
+            "destination": intermediate_city,
+            "departure_at": flight1.departure_at,
+            "arrival_at": flight1.arrival_at,
+            "price": flight1.price,
+            "airline": flight1.airline,
+            "flight_number": flight1.flight_number,
+            "link": flight1.link,
+            "duration": flight1.duration
+        },
+        "leg2": {
+            "origin": leg2_origin,  # Используем реальный аэропорт вылета
+            "destination": flight2.destination,
+            "departure_at": flight2.departure_at,
+            "arrival_at": flight2.arrival_at or flight2.departure_at,
+            "price": flight2.price,
+            "airline": flight2.airline,
+            "flight_number": flight2.flight_number,
+            "link": flight2.link,
+            "duration": flight2.duration
+        }
+    }
+
+    # Добавляем информацию о переходе между аэропортами, если применимо
+    if leg2_origin != intermediate_city and airport_network:
+        # Получаем расстояние из сети аэропортов
+        transfer_distance = None
+        from_city_name = None
+        to_city_name = None
+
+        if intermediate_city in airport_network and leg2_origin in airport_network:
+            from_info = airport_network[intermediate_city]
+            to_info = airport_network[leg2_origin]
+
+            from_city_name = from_info.get("municipality", "")
+            to_city_name = to_info.get("municipality", "")
+
+            # Получаем расстояние из nearby_airports
+            nearby_airports = from_info.get("nearby_airports", [])
+            for nearby_item in nearby_airports:
+                if isinstance(nearby_item, dict) and nearby_item.get("iata") == leg2_origin:
+                    transfer_distance = nearby_item.get("distance_km")
+                    break
+
+        combination["airport_transfer"] = {
+            "from_airport": intermediate_city,
+            "from_city": from_city_name,
+            "to_airport": leg2_origin,
+            "to_city": to_city_name,
+            "distance_km": transfer_distance
+        }
+
+    return combination
+
+
+def scan_pairs(leg1_flights: List[Flight], leg2_flights: List[Flight],
+               allowed_by_city: Dict[str, Set[str]],
+               min_stay: int, max_stay: int) -> List[Tuple[float, int, int, int]]:
+    """
+    Перебирает пары рейсов и отбирает те, что подходят по длительности пребывания.
+
+    Args:
+        leg1_flights: Рейсы первого этапа
+        leg2_flights: Рейсы второго этапа (у всех есть departure_at)
+        allowed_by_city: Допустимые аэропорты вылета второго рейса для каждого
+            промежуточного города; рейсы в другие города пропускаются
+        min_stay: Минимальная длительность пребывания в днях
+        max_stay: Максимальная длительность пребывания в днях
+
+    Returns:
+        Кортежи (total_price, индекс рейса 1, индекс рейса 2, stay_days)
+    """
+    # Индексируем рейсы второго этапа по аэропорту вылета, чтобы для каждого
+    # первого рейса перебирать только подходящие вторые рейсы. Внутри аэропорта
+    # рейсы упорядочены по времени вылета: (времена, рейсы, рейсы без разобранного времени)
+    leg2_by_origin = {}
+    for index2, flight2 in sorted(enumerate(leg2_flights),
+                                  key=lambda item: item[1].departure_seconds or 0):
+        bucket = leg2_by_origin.get(flight2.origin)
+        if bucket is None:
+            bucket = leg2_by_origin[flight2.origin] = ([], [], [])
+        if flight2.departure_seconds is None:
+            bucket[2].append((index2, flight2))
+        else:
+            bucket[0].append(flight2.departure_seconds)
+            bucket[1].append((index2, flight2))
+
+    # Длительность пребывания монотонна по времени вылета, поэтому подходящие
+    # вторые рейсы образуют непрерывный диапазон [min_stay; max_stay + 1) дней
+    window_start = min_stay * SECONDS_PER_DAY
+    window_end = (max_stay + 1) * SECONDS_PER_DAY
+
+    hits = []
+
+    for index1, flight1 in enumerate(leg1_flights):
+        allowed_airports = allowed_by_city.get(flight1.destination)
+
+        # Если нет данных о прибытии, пропускаем этот рейс
+        arrival_at = flight1.arrival_at
+        if allowed_airports is None or not arrival_at:
+            continue
+        arrival_seconds = flight1.arrival_seconds
+        price1 = flight1.price
+
+        # Берем вторые рейсы только из допустимых аэропортов
+        for airport in allowed_airports:
+            bucket = leg2_by_origin.get(airport)
+            if bucket is None:
+                continue
+            departures, timed, untimed = bucket
+
+            if arrival_seconds is not None:
+                # Находим диапазон бинарным поиском и не перебираем остальные рейсы
+                start = bisect_left(departures, arrival_seconds + window_start)
+                end = bisect_left(departures, arrival_seconds + window_end, start)
+                for index2, flight2 in timed[start:end]:
+                    stay_days = (flight2.departure_seconds - arrival_seconds) // SECONDS_PER_DAY
+                    hits.append((price1 + flight2.price, index1, index2, stay_days))
+                remaining = untimed
+            else:
+                remaining = timed + untimed
+
+            # Если время не разобралось, считаем пребывание по-старому для каждой пары
+            for index2, flight2 in remaining:
+                stay_days = calculate_stay_duration(arrival_at, flight2.departure_at)
+                if min_stay <= stay_days <= max_stay:
+                    hits.append((price1 + flight2.price, index1, index2, stay_days))
+
+    return hits
+
+
+def build_scan_arrays(leg1_flights: List[Flight], leg2_flights: List[Flight],
+                      allowed_by_city: Dict[str, Set[str]]) -> Dict[str, Any]:
+    """
+    Раскладывает рейсы по массивам NumPy (по массиву на поле) для компилированного перебора.
+
+    Рейсы второго этапа группируются по аэропорту вылета: bucket_rows содержит их
+    индексы, а bucket_ptr[o]:bucket_ptr[o + 1] - диапазон аэропорта o. Так же
+    для каждого промежуточного города хранится список допустимых аэропортов
+    (group_ptr/group_origins), а leg1_group ссылается на город рейса
+    первого этапа (-1 - рейс пропускается).
+
+    Время с часовым поясом хранится в секундах UTC с отметкой *_aware: как и в
+    calculate_stay_duration, по времени сравниваются только значения одного вида,
+    а для пары времени с часовым поясом и без него пребывание считается по датам.
+
+    Args:
+        leg1_flights: Рейсы первого этапа
+        leg2_flights: Рейсы второго этапа (у всех есть departure_at)
+        allowed_by_city: Допустимые аэропорты вылета второго рейса для каждого промежуточного города
+
+    Returns:
+        Словарь с массивами
+    """
+    origin_ids = {}
+    for flight2 in leg2_flights:
+        origin_ids.setdefault(flight2.origin, len(origin_ids))
+
+    leg2_origin = np.fromiter((origin_ids[flight2.origin] for flight2 in leg2_flights),
+                              dtype=np.int64, count=len(leg2_flights))
+    bucket_ptr = np.zeros(len(origin_ids) + 1, dtype=np.int64)
+    bucket_ptr[1:] = np.cumsum(np.bincount(leg2_origin, minlength=len(origin_ids)))
+
+    group_ids = {}
+    group_ptr = [0]
+    group_origins = []
+    leg1_group = np.full(len(leg1_flights), -1, dtype=np.int64)
+
+    for index1, flight1 in enumerate(leg1_flights):
+        city = flight1.destination
+        allowed_airports = allowed_by_city.get(city)
+        if allowed_airports is None or not flight1.arrival_at:
+            continue
+
+        group = group_ids.get(city)
+        if group is None:
+            group = group_ids[city] = len(group_ids)
+            group_origins.extend(sorted(origin_ids[airport] for airport in allowed_airports
+                                        if airport in origin_ids))
+            group_ptr.append(len(group_origins))
+        leg1_group[index1] = group
+
+    # Время в секундах; если его нет, длительность считается по датам (см. calculate_stay_duration)
+    arrivals = [flight1.arrival_seconds if leg1_group[index1] >= 0 else 0
+                for index1, flight1 in enumerate(leg1_flights)]
+    departures = [flight2.departure_seconds for flight2 in leg2_flights]
+    needs_days = None in arrivals or None in departures
+
+    def time_arrays(seconds: List[Optional[int]], date_strs: List[Optional[str]]):
+        aware = [False] * len(seconds)
+        if needs_days:
+            seconds = list(seconds)
+            for index, date_str in enumerate(date_strs):
+                if seconds[index] is None and date_str:
+                    utc_seconds = datetime_to_utc_seconds(date_str)
+                    if utc_seconds is not None:
+                        seconds[index] = utc_seconds
+                        aware[index] = True
+        seconds_ok = np.array([value is not None for value in seconds], dtype=np.bool_)
+        seconds_arr = np.array([value or 0 for value in seconds], dtype=np.int64)
+        aware_arr = np.array(aware, dtype=np.bool_)
+        days = [date_to_day(date_str) if needs_days and date_str else None for date_str in date_strs]
+        days_ok = np.array([value is not None for value in days], dtype=np.bool_)
+        days_arr = np.array([value or 0 for value in days], dtype=np.int64)
+        return seconds_arr, seconds_ok, aware_arr, days_arr, days_ok
+
+    arrival_sec, arrival_sec_ok, arrival_aware, arrival_day, arrival_day_ok = time_arrays(
+        arrivals, [flight1.arrival_at for flight1 in leg1_flights])
+    departure_sec, departure_sec_ok, departure_aware, departure_day, departure_day_ok = time_arrays(
+        departures, [flight2.departure_at for flight2 in leg2_flights])
+
+    return {
+        "leg1_group": leg1_group,
+        "group_ptr": np.array(group_ptr, dtype=np.int64),
+        "group_origins": np.array(group_origins, dtype=np.int64),
+        "bucket_ptr": bucket_ptr,
+        "bucket_rows": np.argsort(leg2_origin, kind="stable"),
+        "arrival_sec": arrival_sec,
+        "arrival_sec_ok": arrival_sec_ok,
+        "arrival_aware": arrival_aware,
+        "arrival_day": arrival_day,
+        "arrival_day_ok": arrival_day_ok,
+        "departure_sec": departure_sec,
+        "departure_sec_ok": departure_sec_ok,
+        "departure_aware": departure_aware,
+        "departure_day": departure_day,
+        "departure_day_ok": departure_day_ok
+    }
+
+
+def pairs_to_hits(leg1_flights: List[Flight], leg2_flights: List[Flight],
+                  out_index1: "np.ndarray", out_index2: "np.ndarray",
+                  out_stay: "np.ndarray") -> List[Tuple[float, int, int, int]]:
+    """
+    Превращает массивы найденных пар в кортежи (total_price, индекс рейса 1, индекс рейса 2, stay_days).
+
+    Цены складываются в Python, чтобы сохранить их исходный тип (int/float).
+    """
+    prices1 = [flight1.price for flight1 in leg1_flights]
+    prices2 = [flight2.price for flight2 in leg2_flights]
+    return [
+        (prices1[index1] + prices2[index2], index1, index2, stay_days)
+        for index1, index2, stay_days in zip(out_index1.tolist(), out_index2.tolist(), out_stay.tolist())
+    ]
+
+
+def scan_pairs_numpy(leg1_flights: List[Flight], leg2_flights: List[Flight],
+                     allowed_by_city: Dict[str, Set[str]],
+                     min_stay: int, max_stay: int) -> List[Tuple[float, int, int, int]]:
+    """
+    То же, что scan_pairs, но без цикла по парам в Python: для всех рейсов первого этапа
+    в один промежуточный город длительность пребывания до всех допустимых вторых рейсов
+    считается одной матричной операцией NumPy.
+
+    Args:
+        leg1_flights: Рейсы первого этапа
+        leg2_flights: Рейсы второго этапа (у всех есть departure_at)
+        allowed_by_city: Допустимые аэропорты вылета второго рейса для каждого промежуточного города
+        min_stay: Минимальная длительность пребывания в днях
+        max_stay: Максимальная длительность пребывания в днях
+
+    Returns:
+        Кортежи (total_price, индекс рейса 1, индекс рейса 2, stay_days)
+    """
+    arrays = build_scan_arrays(leg1_flights, leg2_flights, allowed_by_city)
+    leg1_group = arrays["leg1_group"]
+    group_ptr = arrays["group_ptr"]
+    group_origins = arrays["group_origins"]
+    bucket_ptr = arrays["bucket_ptr"]
+    bucket_rows = arrays["bucket_rows"]
+    arrival_sec = arrays["arrival_sec"]
+    departure_sec = arrays["departure_sec"]
+
+    # Запасной расчет по датам нужен, только если у части рейсов не разобралось время
+    # или время с часовым поясом встречается вместе со временем без него
+    aware = np.concatenate([arrays["arrival_aware"][leg1_group >= 0], arrays["departure_aware"]])
+    exact = bool(arrays["arrival_sec_ok"][leg1_group >= 0].all() and arrays["departure_sec_ok"].all()
+                 and (aware.all() or not aware.any()))
+
+    # Рейсы первого этапа, упорядоченные по городу: group_bounds[g]:group_bounds[g + 1]
+    order1 = np.argsort(leg1_group, kind="stable")
+    group_bounds = np.searchsorted(leg1_group[order1], np.arange(len(group_ptr)))
+
+    out_index1, out_index2, out_stay = [], [], []
+
+    for group in range(len(group_ptr) - 1):
+        rows = order1[group_bounds[group]:group_bounds[group + 1]]
+        origins = group_origins[group_ptr[group]:group_ptr[group + 1]]
+        if not len(rows) or not len(origins):
+            continue
+
+        cols = np.concatenate([bucket_rows[bucket_ptr[origin]:bucket_ptr[origin + 1]] for origin in origins])
+        block = max(1, NUMPY_BLOCK_PAIRS // len(cols))
+
+        for start in range(0, len(rows), block):
+            block_rows = rows[start:start + block]
+            stay = (departure_sec[cols][None, :] - arrival_sec[block_rows][:, None]) // SECONDS_PER_DAY
+
+            if not exact:
+                seconds_ok = (arrays["arrival_sec_ok"][block_rows][:, None] & arrays["departure_sec_ok"][cols][None, :]
+                              & (arrays["arrival_aware"][block_rows][:, None] == arrays["departure_aware"][cols][None, :]))
+                days_ok = arrays["arrival_day_ok"][block_rows][:, None] & arrays["departure_day_ok"][cols][None, :]
+                days = arrays["departure_day"][cols][None, :] - arrays["arrival_day"][block_rows][:, None]
+                stay = np.where(seconds_ok, stay, np.where(days_ok, days, 0))
+
+            hit_rows, hit_cols = np.nonzero((stay >= min_stay) & (stay <= max_stay))
+            out_index1.append(block_rows[hit_rows])
+            out_index2.append(cols[hit_cols])
+            out_stay.append(stay[hit_rows, hit_cols])
+
+    if not out_index1:
+        return []
+
+    return pairs_to_hits(leg1_flights, leg2_flights, np.concatenate(out_index1),
+                         np.concatenate(out_index2), np.concatenate(out_stay))
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _stay_days_jit(arrival_sec, arrival_sec_ok, arrival_aware, arrival_day, arrival_day_ok,
+                       departure_sec, departure_sec_ok, departure_aware, departure_day, departure_day_ok):
+        # По времени сравниваются только значения одного вида (с часовым поясом или без)
+        if arrival_sec_ok and departure_sec_ok and arrival_aware == departure_aware:
+            return (departure_sec - arrival_sec) // SECONDS_PER_DAY
+        if arrival_day_ok and departure_day_ok:
+            return departure_day - arrival_day
+        return 0
+
+    @numba.njit(parallel=True, cache=True)
+    def _scan_pairs_jit(leg1_group, group_ptr, group_origins, bucket_ptr, bucket_rows,
+                        arrival_sec, arrival_sec_ok, arrival_aware, arrival_day, arrival_day_ok,
+                        departure_sec, departure_sec_ok, departure_aware, departure_day, departure_day_ok,
+                        min_stay, max_stay):
+        n1 = leg1_group.shape[0]
+
+        # Первый проход считает подходящие пары для каждого рейса, второй - заполняет
+        # результат по вычисленным смещениям, поэтому потокам не нужна синхронизация
+        counts = np.zeros(n1, dtype=np.int64)
+        for index1 in numba.prange(n1):
+            group = leg1_group[index1]
+            if group < 0:
+                continue
+            count = 0
+            for k in range(group_ptr[group], group_ptr[group + 1]):
+                origin = group_origins[k]
+                for p in range(bucket_ptr[origin], bucket_ptr[origin + 1]):
+                    index2 = bucket_rows[p]
+                    stay_days = _stay_days_jit(
+                        arrival_sec[index1], arrival_sec_ok[index1], arrival_aware[index1],
+                        arrival_day[index1], arrival_day_ok[index1],
+                        departure_sec[index2], departure_sec_ok[index2], departure_aware[index2],
+                        departure_day[index2], departure_day_ok[index2])
+                    if min_stay <= stay_days <= max_stay:
+                        count += 1
+            counts[index1] = count
+
+        offsets = np.zeros(n1 + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        out_index1 = np.empty(offsets[n1], dtype=np.int64)
+        out_index2 = np.empty(offsets[n1], dtype=np.int64)
+        out_stay = np.empty(offsets[n1], dtype=np.int64)
+
+        for index1 in numba.prange(n1):
+            group = leg1_group[index1]
+            if group < 0:
+                continue
+            pos = offsets[index1]
+            for k in range(group_ptr[group], group_ptr[group + 1]):
+                origin = group_origins[k]
+                for p in range(bucket_ptr[origin], bucket_ptr[origin + 1]):
+                    index2 = bucket_rows[p]
+                    stay_days = _stay_days_jit(
+                        arrival_sec[index1], arrival_sec_ok[index1], arrival_aware[index1],
+                        arrival_day[index1], arrival_day_ok[index1],
+                        departure_sec[index2], departure_sec_ok[index2], departure_aware[index2],
+                        departure_day[index2], departure_day_ok[index2])
+                    if min_stay <= stay_days <= max_stay:
+                        out_index1[pos] = index1
+                        out_index2[pos] = index2
+                        out_stay[pos] = stay_days
+                        pos += 1
+
+        return out_index1, out_index2, out_stay
+
+
+def scan_pairs_jit(leg1_flights: List[Flight], leg2_flights: List[Flight],
+                   allowed_by_city: Dict[str, Set[str]],
+                   min_stay: int, max_stay: int) -> List[Tuple[float, int, int, int]]:
+    """
+    То же, что scan_pairs, но перебор пар выполняется скомпилированным numba ядром
+    параллельно по рейсам первого этапа.
+
+    Args:
+        leg1_flights: Рейсы первого этапа
+        leg2_flights: Рейсы второго этапа (у всех есть departure_at)
+        allowed_by_city: Допустимые аэропорты вылета второго рейса для каждого промежуточного города
+        min_stay: Минимальная длительность пребывания в днях
+        max_stay: Максимальная длительность пребывания в днях
+
+    Returns:
+        Кортежи (total_price, индекс рейса 1, индекс рейса 2, stay_days)
+    """
+    arrays = build_scan_arrays(leg1_flights, leg2_flights, allowed_by_city)
+    out_index1, out_index2, out_stay = _scan_pairs_jit(
+        arrays["leg1_group"], arrays["group_ptr"], arrays["group_origins"],
+        arrays["bucket_ptr"], arrays["bucket_rows"],
+        arrays["arrival_sec"], arrays["arrival_sec_ok"], arrays["arrival_aware"],
+        arrays["arrival_day"], arrays["arrival_day_ok"],
+        arrays["departure_sec"], arrays["departure_sec_ok"], arrays["departure_aware"],
+        arrays["departure_day"], arrays["departure_day_ok"],
+        min_stay, max_stay)
+
+    return pairs_to_hits(leg1_flights, leg2_flights, out_index1, out_index2, out_stay)
+
+
 def find_combinations(data: Dict[str, Any], min_stay: int = 1,
                      max_stay: int = 30,
                      leg1_depart_from: str = None, leg1_depart_to: str = None,
@@ -226,10 +981,15 @@ def find_combinations(data: Dict[str, Any], min_stay: int = 1,
                      via_city: str = None,
                      airport_network: Dict[str, List[Dict]] = None,
                      max_airport_distance: float = 100,
-                     same_country_only: bool = True) -> List[Dict[str, Any]]:
+                     same_country_only: bool = True,
+                     top_n: int = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
     """
     Находит все возможные комбинации перелетов.
 
+    Во время перебора пар сохраняются только легкие кортежи
+    (total_price, индекс рейса 1, индекс рейса 2, stay_days); полные словари
+    комбинаций строятся лишь для тех, что попадут в результат.
+
     Args:
         data: Данные о перелетах
         min_stay: Минимальная длительность пребывания в днях
@@ -242,58 +1002,44 @@ def find_combinations(data: Dict[str, Any], min_stay: int = 1,
         airport_network: Сеть аэропортов для учета переходов между близкими аэропортами
         max_airport_distance: Максимальное расстояние между аэропортами (км)
         same_country_only: Если True, переходы только между аэропортами одной страны
+        top_n: Если указано, возвращаются только top_n самых дешевых комбинаций
 
     Returns:
-        Список комбинаций перелетов
+        Кортеж (список комбинаций, отсортированный по цене; статистика по всем комбинациям)
     """
-    leg1_flights = data.get("leg1_flights", [])
-    leg2_flights = data.get("leg2_flights", [])
-
-    # Фильтруем первые рейсы по дате вылета, если указано
-    if leg1_depart_from or leg1_depart_to:
-        filtered_leg1 = []
-        for flight in leg1_flights:
-            if not flight.get("departure_at"):
-                continue
-            try:
-                # Извлекаем дату вылета
-                depart_date = flight["departure_at"].split("T")[0]
-
-                # Проверяем диапазон
-                if leg1_depart_from and depart_date < leg1_depart_from:
-                    continue
-                if leg1_depart_to and depart_date > leg1_depart_to:
-                    continue
-
-                filtered_leg1.append(flight)
-            except Exception:
-                continue
-
-        leg1_flights = filtered_leg1
-
-    # Фильтруем вторые рейсы по дате вылета, если указано
-    if leg2_depart_from or leg2_depart_to:
-        filtered_leg2 = []
-        for flight in leg2_flights:
-            if not flight.get("departure_at"):
-                continue
-            try:
-                # Извлекаем дату вылета
-                depart_date = flight["departure_at"].split("T")[0]
-
-                # Проверяем диапазон
-                if leg2_depart_from and depart_date < leg2_depart_from:
-                    continue
-                if leg2_depart_to and depart_date > leg2_depart_to:
-                    continue
-
-                filtered_leg2.append(flight)
-            except Exception:
-                continue
-
-        leg2_flights = filtered_leg2
+    # Допустимые аэропорты вылета второго рейса для фильтра по промежуточному городу
+    via_airports = None
+    if via_city:
+        if airport_network:
+            via_airports = get_nearby_airports(via_city, airport_network,
+                                               max_airport_distance, same_country_only)
+        else:
+            via_airports = {via_city}
+
+    # Фильтры по дате и по промежуточному городу проверяем по исходным полям
+    # в том же проходе, что и нормализацию: отброшенные рейсы не нормализуются.
+    # В сообщении об анализе учитываются рейсы, прошедшие фильтр по дате
+    leg1_flights = []
+    leg1_count = 0
+    for raw_flight in data.get("leg1_flights", []):
+        if not departure_in_range(raw_flight.get("departure_at"), leg1_depart_from, leg1_depart_to):
+            continue
+        leg1_count += 1
+        if via_city and (raw_flight.get("destination") or raw_flight.get("search_destination")) != via_city:
+            continue
+        leg1_flights.append(normalize_flight(raw_flight))
 
-    combinations = []
+    leg2_flights = []
+    leg2_count = 0
+    for raw_flight in data.get("leg2_flights", []):
+        if not departure_in_range(raw_flight.get("departure_at"), leg2_depart_from, leg2_depart_to):
+            continue
+        leg2_count += 1
+        if not raw_flight.get("departure_at"):
+            continue
+        if via_airports is not None and (raw_flight.get("origin") or raw_flight.get("search_origin")) not in via_airports:
+            continue
+        leg2_flights.append(normalize_flight(raw_flight))
 
     # Формируем информацию о фильтрах
     leg1_filter = ""
@@ -316,143 +1062,57 @@ def find_combinations(data: Dict[str, Any], min_stay: int = 1,
     airport_transfer_info = ""
     if airport_network:
         airport_transfer_info = f" (с учетом переходов между аэропортами до {max_airport_distance} км)"
-    print(f"\nАнализ {len(leg1_flights)} рейсов первого этапа{leg1_filter} и {len(leg2_flights)} рейсов второго этапа{leg2_filter}{via_filter}{airport_transfer_info}...")
+    print(f"\nАнализ {leg1_count} рейсов первого этапа{leg1_filter} и {leg2_count} рейсов второго этапа{leg2_filter}{via_filter}{airport_transfer_info}...")
 
+    # Определяем допустимые аэропорты вылета второго рейса для каждого промежуточного города
+    # (либо тот же аэропорт, либо близлежащие, если включена сеть)
+    allowed_by_city = {}
     for flight1 in leg1_flights:
-        # Получаем город прибытия первого рейса
-        intermediate_city = flight1.get("destination") or flight1.get("search_destination")
-
-        # Фильтруем по конкретному промежуточному городу, если указано
-        if via_city and intermediate_city != via_city:
+        intermediate_city = flight1.destination
+        if intermediate_city in allowed_by_city:
             continue
 
-        # Определяем набор допустимых аэропортов для второго рейса
-        # (либо тот же аэропорт, либо близлежащие, если включена сеть)
         if airport_network and intermediate_city:
-            allowed_airports = get_nearby_airports(intermediate_city, airport_network,
-                                                  max_airport_distance, same_country_only)
-        else:
-            allowed_airports = {intermediate_city} if intermediate_city else set()
-
-        # Вычисляем дату/время прибытия первого рейса
-        if flight1.get("arrival_at"):
-            arrival_at = flight1["arrival_at"]
-        elif flight1.get("departure_at") and flight1.get("duration"):
-            # Вычисляем на основе departure_at + duration
-            arrival_at = calculate_arrival(flight1["departure_at"], flight1["duration"])
+            allowed_by_city[intermediate_city] = get_nearby_airports(
+                intermediate_city, airport_network, max_airport_distance, same_country_only)
         else:
-            # Если нет данных, пропускаем этот рейс
-            continue
+            allowed_by_city[intermediate_city] = {intermediate_city} if intermediate_city else set()
 
-        for flight2 in leg2_flights:
-            # Проверяем, что второй рейс начинается из допустимого аэропорта
-            leg2_origin = flight2.get("origin") or flight2.get("search_origin")
-
-            if leg2_origin not in allowed_airports:
-                continue
+    if numba is not None and len(leg1_flights) * len(leg2_flights) >= JIT_MIN_PAIRS:
+        hits = scan_pairs_jit(leg1_flights, leg2_flights, allowed_by_city, min_stay, max_stay)
+    elif np is not None:
+        hits = scan_pairs_numpy(leg1_flights, leg2_flights, allowed_by_city, min_stay, max_stay)
+    else:
+        hits = scan_pairs(leg1_flights, leg2_flights, allowed_by_city, min_stay, max_stay)
 
-            # Определяем, является ли это переходом между аэропортами
-            is_airport_transfer = leg2_origin != intermediate_city
+    stats = get_statistics(hits, leg1_flights)
 
-            # Получаем дату/время отправления второго рейса
-            if not flight2.get("departure_at"):
-                continue
-            departure_at = flight2["departure_at"]
+    # Кортежи упорядочены по цене, а при равной цене - в порядке перебора
+    if top_n is not None:
+        survivors = heapq.nsmallest(top_n, hits)
+    else:
+        survivors = sorted(hits)
 
-            # Вычисляем длительность пребывания
-            stay_days = calculate_stay_duration(arrival_at, departure_at)
+    combinations = [
+        build_combination(leg1_flights[index1], leg2_flights[index2], stay_days, airport_network)
+        for _, index1, index2, stay_days in survivors
+    ]
 
-            # Проверяем, что пребывание в допустимых пределах
-            if stay_days < min_stay or stay_days > max_stay:
-                continue
+    return combinations, stats
 
-            # Вычисляем общую стоимость
-            price1 = flight1.get("price") or flight1.get("value", 0)
-            price2 = flight2.get("price") or flight2.get("value", 0)
-            total_price = price1 + price2
 
-            # Вычисляем время прибытия второго рейса
-            if flight2.get("arrival_at"):
-                leg2_arrival = flight2["arrival_at"]
-            elif flight2.get("departure_at") and flight2.get("duration"):
-                leg2_arrival = calculate_arrival(flight2["departure_at"], flight2["duration"])
-            else:
-                leg2_arrival = departure_at
-
-            # Формируем комбинацию
-            combination = {
-                "total_price": total_price,
-                "stay_days": stay_days,
-                "intermediate_city": intermediate_city,
-                "leg1": {
-                    "origin": flight1.get("origin") or flight1.get("search_origin"),
-                    "destination": intermediate_city,
-                    "departure_at": flight1.get("departure_at"),
-                    "arrival_at": arrival_at,
-                    "price": price1,
-                    "airline": flight1.get("airline"),
-                    "flight_number": flight1.get("flight_number"),
-                    "link": flight1.get("link"),
-                    "duration": flight1.get("duration")
-                },
-                "leg2": {
-                    "origin": leg2_origin,  # Используем реальный аэропорт вылета
-                    "destination": flight2.get("destination") or flight2.get("search_destination"),
-                    "departure_at": departure_at,
-                    "arrival_at": leg2_arrival,
-                    "price": price2,
-                    "airline": flight2.get("airline"),
-                    "flight_number": flight2.get("flight_number"),
-                    "link": flight2.get("link"),
-                    "duration": flight2.get("duration")
-                }
-            }
-
-            # Добавляем информацию о переходе между аэропортами, если применимо
-            if is_airport_transfer and airport_network:
-                # Получаем расстояние из сети аэропортов
-                transfer_distance = None
-                from_city_name = None
-                to_city_name = None
-
-                if intermediate_city in airport_network and leg2_origin in airport_network:
-                    from_info = airport_network[intermediate_city]
-                    to_info = airport_network[leg2_origin]
-
-                    from_city_name = from_info.get("municipality", "")
-                    to_city_name = to_info.get("municipality", "")
-
-                    # Получаем расстояние из nearby_airports
-                    nearby_airports = from_info.get("nearby_airports", [])
-                    for nearby_item in nearby_airports:
-                        if isinstance(nearby_item, dict) and nearby_item.get("iata") == leg2_origin:
-                            transfer_distance = nearby_item.get("distance_km")
-                            break
-
-                combination["airport_transfer"] = {
-                    "from_airport": intermediate_city,
-                    "from_city": from_city_name,
-                    "to_airport": leg2_origin,
-                    "to_city": to_city_name,
-                    "distance_km": transfer_distance
-                }
-
-            combinations.append(combination)
-
-    return combinations
-
-
-def get_statistics(combinations: List[Dict[str, Any]]) -> Dict[str, Any]:
+def get_statistics(hits: List[Tuple[float, int, int, int]], leg1_flights: List[Flight]) -> Dict[str, Any]:
     """
     Вычисляет статистику по найденным комбинациям.
 
     Args:
-        combinations: Список комбинаций перелетов
+        hits: Кортежи (total_price, индекс рейса 1, индекс рейса 2, stay_days)
+        leg1_flights: Рейсы первого этапа, на которые ссылаются индексы
 
     Returns:
         Словарь со статистикой
     """
-    if not combinations:
+    if not hits:
         return {
             "total_combinations": 0,
             "min_price": 0,
@@ -461,32 +1121,59 @@ def get_statistics(combinations: List[Dict[str, Any]]) -> Dict[str, Any]:
             "median_price": 0
         }
 
-    prices = [c["total_price"] for c in combinations]
-    prices.sort()
-
-    # Статистика по промежуточным городам
-    cities_stats = defaultdict(lambda: {"count": 0, "min_price": float('inf'), "avg_prices": []})
-
-    for combo in combinations:
-        city = combo["intermediate_city"]
-        price = combo["total_price"]
-        cities_stats[city]["count"] += 1
-        cities_stats[city]["min_price"] = min(cities_stats[city]["min_price"], price)
-        cities_stats[city]["avg_prices"].append(price)
-
-    # Вычисляем средние цены
-    for city in cities_stats:
-        avg_price = sum(cities_stats[city]["avg_prices"]) / len(cities_stats[city]["avg_prices"])
-        cities_stats[city]["avg_price"] = round(avg_price, 2)
-        del cities_stats[city]["avg_prices"]
+    # Общие минимум, максимум и сумма считаются в том же проходе, что и статистика
+    # по промежуточным городам; список цен нужен только для медианы.
+    # По городам цены не хранятся: [количество, сумма, минимальная цена, индекс первого рейса в город]
+    # Обычный dict с get: без вызова lambda из defaultdict на каждый новый город
+    prices = []
+    min_price = max_price = hits[0][0]
+    total_price = 0
+    cities_totals = {}
+
+    for price, index1, _, _ in hits:
+        prices.append(price)
+        total_price += price
+        if price < min_price:
+            min_price = price
+        elif price > max_price:
+            max_price = price
+
+        city = leg1_flights[index1].destination
+        totals = cities_totals.get(city)
+        if totals is None:
+            totals = cities_totals[city] = [0, 0, price, index1]
+        totals[0] += 1
+        totals[1] += price
+        if price < totals[2]:
+            totals[2] = price
+        if index1 < totals[3]:
+            totals[3] = index1
+
+    middle = len(prices) // 2
+
+    # Для медианы достаточно частичной сортировки (quickselect), полная сортировка не нужна.
+    # argpartition возвращает индекс, поэтому цена сохраняет исходный тип (int/float)
+    if np is not None and len(prices) > MEDIAN_PARTITION_MIN:
+        median_price = prices[int(np.argpartition(np.array(prices, dtype=np.float64), middle)[middle])]
+    else:
+        median_price = sorted(prices)[middle]
+
+    # Города перечисляем в порядке рейсов первого этапа, независимо от порядка перебора пар
+    cities_stats = {}
+    for city, (count, total, city_min_price, _) in sorted(cities_totals.items(), key=lambda item: item[1][3]):
+        cities_stats[city] = {
+            "count": count,
+            "min_price": city_min_price,
+            "avg_price": round(total / count, 2)
+        }
 
     return {
-        "total_combinations": len(combinations),
-        "min_price": min(prices),
-        "max_price": max(prices),
-        "avg_price": round(sum(prices) / len(prices), 2),
-        "median_price": prices[len(prices) // 2],
-        "by_intermediate_city": dict(cities_stats)
+        "total_combinations": len(hits),
+        "min_price": min_price,
+        "max_price": max_price,
+        "avg_price": round(total_price / len(prices), 2),
+        "median_price": median_price,
+        "by_intermediate_city": cities_stats
     }
 
 
@@ -497,38 +1184,44 @@ def print_summary(combinations: List[Dict[str, Any]], stats: Dict[str, Any],
     Выводит сводку по найденным комбинациям.
 
     Args:
-        combinations: Список комбинаций перелетов
+        combinations: Список комбинаций перелетов, отсортированный по цене
         stats: Статистика
         top_n: Количество лучших вариантов для отображения
         unique_cities: Если True, показывает только уникальные промежуточные города (самые дешевые)
         airport_network: Сеть аэропортов для получения информации о городах
     """
-    print(f"\n{'='*80}")
-    print("РЕЗУЛЬТАТЫ АНАЛИЗА")
-    print(f"{'='*80}\n")
-
-    if not combinations:
-        print("❌ Не найдено подходящих комбинаций перелетов")
+    # Собираем вывод в буфер и печатаем одной записью вместо сотен вызовов print
+    buffer = io.StringIO()
+    emit = partial(print, file=buffer)
+
+    emit(f"\n{'='*80}")
+    emit("РЕЗУЛЬТАТЫ АНАЛИЗА")
+    emit(f"{'='*80}\n")
+
+    # Комбинаций может быть больше, чем выведено (например, при --top 0)
+    if not stats["total_combinations"]:
+        emit("❌ Не найдено подходящих комбинаций перелетов")
+        sys.stdout.write(buffer.getvalue())
         return
 
-    print(f"✓ Найдено комбинаций: {stats['total_combinations']}")
-    print(f"\nСтатистика по ценам:")
-    print(f"  Минимальная: {stats['min_price']:,.0f}")
-    print(f"  Средняя:     {stats['avg_price']:,.0f}")
-    print(f"  Медианная:   {stats['median_price']:,.0f}")
-    print(f"  Максимальная: {stats['max_price']:,.0f}")
+    emit(f"✓ Найдено комбинаций: {stats['total_combinations']}")
+    emit(f"\nСтатистика по ценам:")
+    emit(f"  Минимальная: {stats['min_price']:,.0f}")
+    emit(f"  Средняя:     {stats['avg_price']:,.0f}")
+    emit(f"  Медианная:   {stats['median_price']:,.0f}")
+    emit(f"  Максимальная: {stats['max_price']:,.0f}")
 
     if stats.get("by_intermediate_city"):
-        print(f"\nСтатистика по промежуточным городам:")
+        emit(f"\nСтатистика по промежуточным городам:")
         for city, city_stats in sorted(stats["by_intermediate_city"].items(),
                                       key=lambda x: x[1]["min_price"]):
-            print(f"  {city}:")
-            print(f"    - Комбинаций: {city_stats['count']}")
-            print(f"    - Мин. цена: {city_stats['min_price']:,.0f}")
-            print(f"    - Сред. цена: {city_stats['avg_price']:,.0f}")
+            emit(f"  {city}:")
+            emit(f"    - Комбинаций: {city_stats['count']}")
+            emit(f"    - Мин. цена: {city_stats['min_price']:,.0f}")
+            emit(f"    - Сред. цена: {city_stats['avg_price']:,.0f}")
 
-    # Сортируем по цене
-    sorted_combinations = sorted(combinations, key=lambda x: x["total_price"])
+    # Комбинации уже отсортированы по цене в find_combinations
+    sorted_combinations = combinations
 
     # Фильтруем по уникальным городам, если требуется
     if unique_cities:
@@ -541,24 +1234,24 @@ def print_summary(combinations: List[Dict[str, Any]], stats: Dict[str, Any],
                 filtered_combinations.append(combo)
         sorted_combinations = filtered_combinations
 
-    print(f"\n{'='*80}")
+    emit(f"\n{'='*80}")
     title = f"ТОП-{min(top_n, len(sorted_combinations))} САМЫХ ДЕШЕВЫХ ВАРИАНТОВ"
     if unique_cities:
         title += " (уникальные города)"
-    print(title)
-    print(f"{'='*80}\n")
+    emit(title)
+    emit(f"{'='*80}\n")
 
     for i, combo in enumerate(sorted_combinations[:top_n], 1):
-        print(f"#{i}. Общая стоимость: {combo['total_price']:,.0f} RUB | "
+        emit(f"#{i}. Общая стоимость: {combo['total_price']:,.0f} RUB | "
               f"Пребывание: {combo['stay_days']} дней")
 
         # Получаем название промежуточного города
         intermediate_city = combo['intermediate_city']
         city_name = get_airport_city_name(intermediate_city, airport_network)
         if city_name:
-            print(f"    Промежуточный город: {intermediate_city} ({city_name})")
+            emit(f"    Промежуточный город: {intermediate_city} ({city_name})")
         else:
-            print(f"    Промежуточный город: {intermediate_city}")
+            emit(f"    Промежуточный город: {intermediate_city}")
 
         leg1 = combo["leg1"]
         duration1_str = f"{leg1.get('duration', 0) // 60}ч {leg1.get('duration', 0) % 60}м" if leg1.get('duration') else ""
@@ -576,31 +1269,31 @@ def print_summary(combinations: List[Dict[str, Any]], stats: Dict[str, Any],
         if dest1_city:
             route1 += f" ({dest1_city})"
 
-        print(f"\n    ✈️  Этап 1: {route1}")
-        print(f"        Вылет:       {leg1['departure_at']}")
-        print(f"        Прибытие:    {leg1['arrival_at']}")
+        emit(f"\n    ✈️  Этап 1: {route1}")
+        emit(f"        Вылет:       {leg1['departure_at']}")
+        emit(f"        Прибытие:    {leg1['arrival_at']}")
         if duration1_str:
-            print(f"        Длительность: {duration1_str}")
-        print(f"        Цена:        {leg1['price']:,.0f} RUB")
+            emit(f"        Длительность: {duration1_str}")
+        emit(f"        Цена:        {leg1['price']:,.0f} RUB")
         if leg1.get('airline'):
-            print(f"        Авиакомпания: {leg1['airline']}")
+            emit(f"        Авиакомпания: {leg1['airline']}")
         if leg1.get('flight_number'):
-            print(f"        Рейс: {leg1['airline']} {leg1['flight_number']}")
+            emit(f"        Рейс: {leg1['airline']} {leg1['flight_number']}")
 
         # Показываем информацию о переходе между аэропортами, если есть
         if combo.get("airport_transfer"):
             transfer = combo["airport_transfer"]
-            print(f"\n    🚌 Переход между аэропортами:")
+            emit(f"\n    🚌 Переход между аэропортами:")
             from_str = transfer['from_airport']
             if transfer.get('from_city'):
                 from_str += f" ({transfer['from_city']})"
             to_str = transfer['to_airport']
             if transfer.get('to_city'):
                 to_str += f" ({transfer['to_city']})"
-            print(f"        Из: {from_str}")
-            print(f"        В:  {to_str}")
+            emit(f"        Из: {from_str}")
+            emit(f"        В:  {to_str}")
             if transfer.get('distance_km'):
-                print(f"        Расстояние: {transfer['distance_km']:.2f} км")
+                emit(f"        Расстояние: {transfer['distance_km']:.2f} км")
 
         leg2 = combo["leg2"]
         duration2_str = f"{leg2.get('duration', 0) // 60}ч {leg2.get('duration', 0) % 60}м" if leg2.get('duration') else ""
@@ -618,18 +1311,20 @@ def print_summary(combinations: List[Dict[str, Any]], stats: Dict[str, Any],
         if dest2_city:
             route2 += f" ({dest2_city})"
 
-        print(f"\n    ✈️  Этап 2: {route2}")
-        print(f"        Вылет:       {leg2['departure_at']}")
-        print(f"        Прибытие:    {leg2['arrival_at']}")
+        emit(f"\n    ✈️  Этап 2: {route2}")
+        emit(f"        Вылет:       {leg2['departure_at']}")
+        emit(f"        Прибытие:    {leg2['arrival_at']}")
         if duration2_str:
-            print(f"        Длительность: {duration2_str}")
-        print(f"        Цена:        {leg2['price']:,.0f} RUB")
+            emit(f"        Длительность: {duration2_str}")
+        emit(f"        Цена:        {leg2['price']:,.0f} RUB")
         if leg2.get('airline'):
-            print(f"        Авиакомпания: {leg2['airline']}")
+            emit(f"        Авиакомпания: {leg2['airline']}")
         if leg2.get('flight_number'):
-            print(f"        Рейс: {leg2['airline']} {leg2['flight_number']}")
+            emit(f"        Рейс: {leg2['airline']} {leg2['flight_number']}")
+
+        emit()
 
-        print()
+    sys.stdout.write(buffer.getvalue())
 
 
 def save_results(combinations: List[Dict[str, Any]], stats: Dict[str, Any],
@@ -638,13 +1333,13 @@ def save_results(combinations: List[Dict[str, Any]], stats: Dict[str, Any],
     Сохраняет результаты анализа в JSON файл.
 
     Args:
-        combinations: Список комбинаций
+        combinations: Список комбинаций, отсортированный по цене
         stats: Статистика
         output_file: Путь к выходному файлу
         unique_cities: Если True, сохраняет только уникальные промежуточные города (самые дешевые)
     """
-    # Сортируем по цене
-    sorted_combinations = sorted(combinations, key=lambda x: x["total_price"])
+    # Комбинации уже отсортированы по цене в find_combinations
+    sorted_combinations = combinations
 
     # Фильтруем по уникальным городам, если требуется
     if unique_cities:
@@ -666,8 +1361,7 @@ def save_results(combinations: List[Dict[str, Any]], stats: Dict[str, Any],
     output_path = Path(output_file)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    output_path.write_bytes(json_dumps(result))
 
     print(f"\n✓ Результаты сохранены в {output_file}")
 
@@ -866,13 +1560,16 @@ def main():
     # Определяем, разрешены ли переходы между странами
     same_country_only = not args.allow_cross_country_transfers
 
-    # Находим комбинации
-    combinations = find_combinations(data, args.min_stay, args.max_stay,
-                                    leg1_from, leg1_to, leg2_from, leg2_to, args.via,
-                                    airport_network, args.airport_distance, same_country_only)
+    # Полный список комбинаций нужен только для сохранения в файл и фильтра по городам,
+    # для вывода на экран достаточно top_n самых дешевых
+    # При отрицательном --top срез [:top] отбрасывает последние комбинации, поэтому нужны все
+    top_n = None if args.output or args.unique_cities or args.top < 0 else args.top
 
-    # Вычисляем статистику
-    stats = get_statistics(combinations)
+    # Находим комбинации и вычисляем статистику
+    combinations, stats = find_combinations(data, args.min_stay, args.max_stay,
+                                            leg1_from, leg1_to, leg2_from, leg2_to, args.via,
+                                            airport_network, args.airport_distance, same_country_only,
+                                            top_n)
 
     # Выводим результаты
     print_summary(combinations, stats, args.top, args.unique_cities, airport_network)
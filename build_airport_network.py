@@ -7,8 +7,37 @@
 import json
 import math
 from pathlib import Path
-from typing import Dict, List, Tuple
-from datasets import load_dataset
+from typing import Dict, List, Tuple, Union
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+try:
+    from sklearn.neighbors import BallTree
+except ImportError:  # scikit-learn необязателен, без него расстояния считаются до всех аэропортов
+    BallTree = None
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него сеть сохраняется стандартным json
+    orjson = None
+
+try:
+    import numba
+except ImportError:  # numba необязательна, без нее пары перебираются векторно через NumPy
+    numba = None
+
+
+# Радиус Земли в километрах
+EARTH_RADIUS_KM = 6371.0
+
+# Запас границ отбора кандидатов (в радианах, около 25 м) на погрешность float32
+WINDOW_SLACK_RAD = 4e-6
+
+# Строка координат "latitude, longitude": число до запятой и число до следующей запятой или конца строки
+_NUMBER_PATTERN = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+COORDINATES_PATTERN = rf'^\s*(?P<lat>{_NUMBER_PATTERN})\s*,\s*(?P<lon>{_NUMBER_PATTERN})\s*(?:,|$)'
 
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -62,27 +91,84 @@ def parse_coordinates(coord_str: str) -> Tuple[float, float]:
         return None, None
 
 
-def fetch_airports_from_huggingface() -> List[Dict]:
+def parse_coordinates_array(coord_strs: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Парсит строки с координатами в формате "latitude, longitude" целиком
+    средствами pyarrow, без вызова parse_coordinates для каждой строки.
+
+    Строки обычного вида ("55.97, 37.41") разбираются регулярным выражением и pc.cast.
+    Остальные строки (например, "nan", "1_000" или лишние пробелы) разбираются
+    через parse_coordinates, поэтому результат совпадает с float() для каждой строки.
+
+    Args:
+        coord_strs: Строки с координатами (None и нестроковые значения допускаются)
+
+    Returns:
+        Кортеж массивов (latitudes, longitudes, parsed); parsed - маска разобранных строк,
+        для неразобранных строк координаты - NaN
+    """
+    column = pa.array([c if isinstance(c, str) else None for c in coord_strs], type=pa.string())
+    parts = pc.extract_regex(column, COORDINATES_PATTERN)
+    lats = pc.cast(pc.struct_field(parts, "lat"), pa.float64()).to_numpy(zero_copy_only=False)
+    lons = pc.cast(pc.struct_field(parts, "lon"), pa.float64()).to_numpy(zero_copy_only=False)
+    parsed = pc.is_valid(parts).to_numpy(zero_copy_only=False)
+
+    # Строки, не подошедшие под выражение, разбираем по одной (обычно их единицы)
+    unmatched = np.flatnonzero(pc.and_(pc.is_valid(column), pc.invert(pc.is_valid(parts)))
+                               .to_numpy(zero_copy_only=False))
+    if len(unmatched):
+        lats = lats.copy()
+        lons = lons.copy()
+        parsed = parsed.copy()
+        for k in unmatched.tolist():
+            lat, lon = parse_coordinates(coord_strs[k])
+            if lat is not None and lon is not None:
+                lats[k], lons[k], parsed[k] = lat, lon, True
+
+    return lats, lons, parsed
+
+
+def fetch_airports_from_huggingface(cache_file: str = "data/airports_cache.parquet",
+                                    refresh_cache: bool = False) -> pa.Table:
     """
     Загружает данные об аэропортах из HuggingFace датасета.
 
+    Датасет сохраняется в Parquet файл, и при следующих запусках читается
+    из него без обращения к HuggingFace.
+
+    Args:
+        cache_file: Путь к Parquet файлу с кэшем датасета
+        refresh_cache: Если True, датасет загружается заново и кэш перезаписывается
+
     Returns:
-        Список словарей с данными об аэропортах
+        Таблица Arrow с данными об аэропортах (по строке на аэропорт)
     """
-    print("Загружаем данные об аэропортах из HuggingFace...")
-    print("Это может занять некоторое время при первом запуске...")
+    cache_path = Path(cache_file)
 
     try:
-        # Загружаем датасет
-        dataset = load_dataset("ronnieaban/world-airports", split="train")
+        if cache_path.exists() and not refresh_cache:
+            table = pq.read_table(cache_path)
+            print(f"Датасет загружен из кэша {cache_file}, всего записей: {table.num_rows}")
+        else:
+            print("Загружаем данные об аэропортах из HuggingFace...")
+            print("Это может занять некоторое время при первом запуске...")
+
+            # datasets импортируется только здесь: при чтении из кэша он не нужен
+            from datasets import load_dataset
+
+            # Загружаем датасет
+            dataset = load_dataset("ronnieaban/world-airports", split="train")
 
-        print(f"Датасет загружен, всего записей: {len(dataset)}")
+            print(f"Датасет загружен, всего записей: {len(dataset)}")
+
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            dataset.to_parquet(str(cache_path))
+            table = dataset.data.table
 
         # Фильтруем только аэропорты с IATA кодом и координатами
-        airports = []
-        for row in dataset:
-            if row.get("iata_code") and row.get("coordinates"):
-                airports.append(dict(row))
+        has_iata = pc.fill_null(pc.greater(pc.utf8_length(table["iata_code"]), 0), False)
+        has_coordinates = pc.fill_null(pc.greater(pc.utf8_length(table["coordinates"]), 0), False)
+        airports = table.filter(pc.and_(has_iata, has_coordinates))
 
         print(f"Найдено {len(airports)} аэропортов с IATA кодами и координатами")
         return airports
@@ -92,17 +178,282 @@ def fetch_airports_from_huggingface() -> List[Dict]:
         raise
 
 
-def build_airport_network(airports: List[Dict], max_distance_km: float = 100) -> Dict[str, Dict]:
+def haversine_threshold(max_distance_km: float) -> float:
+    """
+    Вычисляет порог для промежуточной величины формулы гаверсинуса
+    a = sin²(dlat/2) + cos(lat1)·cos(lat2)·sin²(dlon/2).
+
+    Расстояние 2R·asin(√a) монотонно по a, поэтому пары с a выше порога
+    заведомо дальше max_distance_km, и для них не нужно считать asin и √.
+
+    Args:
+        max_distance_km: Максимальное расстояние в км
+
+    Returns:
+        Порог sin²(r/2) для углового радиуса r, с небольшим запасом на погрешность
+    """
+    radius = min(max_distance_km / EARTH_RADIUS_KM, math.pi)
+    return math.sin(radius / 2)**2 * (1 + 1e-9) + 1e-15
+
+
+def search_window(lats: np.ndarray, lons: np.ndarray, cos_lats: np.ndarray,
+                  max_distance_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Готовит отбор кандидатов по прямоугольнику (по широте и долготе), вне которого
+    аэропорт не может оказаться ближе max_distance_km.
+
+    Для отбора хватает точности float32: координаты и границы хранятся в нем,
+    а запас в WINDOW_SLACK_RAD покрывает погрешность округления.
+    Точное расстояние для прошедших отбор пар считается в float64.
+
+    Args:
+        lats, lons: Широты и долготы аэропортов в радианах
+        cos_lats: Косинусы широт
+        max_distance_km: Максимальное расстояние в км
+
+    Returns:
+        Кортеж (order, window_start, window_end, lons32, dlon_max32):
+        order - индексы аэропортов по возрастанию широты; кандидаты для аэропорта i -
+        order[window_start[i]:window_end[i]] с разницей долгот не больше dlon_max32[i]
+    """
+    radius = max_distance_km / EARTH_RADIUS_KM
+    dlat_max = radius * (1 + 1e-9) + WINDOW_SLACK_RAD
+
+    # Если круг радиуса radius захватывает полюс, ограничения по долготе нет
+    dlon_max = np.full(len(lats), 2 * math.pi)
+    if radius < math.pi / 2:
+        sin_radius = math.sin(radius)
+        limited = cos_lats > sin_radius
+        dlon_max[limited] = np.arcsin(sin_radius / cos_lats[limited]) * (1 + 1e-9) + WINDOW_SLACK_RAD
+
+    lats32 = lats.astype(np.float32)
+    order = np.argsort(lats32, kind='stable')
+    sorted_lats = lats32[order]
+    window_start = np.searchsorted(sorted_lats, (lats - dlat_max).astype(np.float32), side='left')
+    window_end = np.searchsorted(sorted_lats, (lats + dlat_max).astype(np.float32), side='right')
+
+    return order, window_start, window_end, lons.astype(np.float32), dlon_max.astype(np.float32)
+
+
+def find_pairs_numpy(lats: np.ndarray, lons: np.ndarray, cos_lats: np.ndarray,
+                     max_distance_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Находит пары аэропортов i < j на расстоянии не больше max_distance_km,
+    вычисляя расстояния векторно по строкам матрицы.
+
+    Если установлен scikit-learn, кандидаты для каждой строки берутся из
+    запроса по радиусу к BallTree, иначе - из ограничивающего прямоугольника.
+
+    Args:
+        lats, lons: Широты и долготы аэропортов в радианах
+        cos_lats: Косинусы широт
+        max_distance_km: Максимальное расстояние в км
+
+    Returns:
+        Массивы (i, j, расстояние в км), упорядоченные по i, затем по j
+    """
+    n = len(lats)
+
+    # Радиус запроса берем с небольшим запасом: точная проверка расстояния выполняется ниже
+    candidates_by_airport = None
+    if BallTree is not None and n:
+        points = np.column_stack([lats, lons])
+        tree = BallTree(points, metric='haversine')
+        radius = max_distance_km / EARTH_RADIUS_KM * (1 + 1e-9)
+        candidates_by_airport = tree.query_radius(points, r=radius)
+    else:
+        # Без дерева отбираем кандидатов по прямоугольнику: окно по широте
+        # находим бинарным поиском в отсортированных широтах, затем проверяем долготу
+        order, window_start, window_end, lons32, dlon_max = search_window(lats, lons, cos_lats, max_distance_km)
+
+    # Половины углов считаем один раз: (b - a) / 2 == b / 2 - a / 2 точно,
+    # так как деление на 2 в двоичной арифметике не вносит погрешности
+    half_lats, half_lons = lats / 2, lons / 2
+    a_max = haversine_threshold(max_distance_km)
+
+    parts_i, parts_j, parts_distances = [], [], []
+    for i in range(n):
+        if candidates_by_airport is not None:
+            candidates = candidates_by_airport[i]
+        else:
+            candidates = order[window_start[i]:window_end[i]]
+            dlon = np.abs(lons32[candidates] - lons32[i])
+            dlon = np.minimum(dlon, np.float32(2 * math.pi) - dlon)
+            candidates = candidates[dlon <= dlon_max[i]]
+
+        # Сохраняем исходный порядок аэропортов при равных расстояниях
+        candidates = np.sort(candidates[candidates > i])
+        cand_half_lats, cand_half_lons, cand_cos = half_lats[candidates], half_lons[candidates], cos_lats[candidates]
+
+        # Формула гаверсинуса для строки i матрицы расстояний
+        half_dlat = cand_half_lats - half_lats[i]
+        half_dlon = cand_half_lons - half_lons[i]
+        a = np.sin(half_dlat)**2 + cos_lats[i] * cand_cos * np.sin(half_dlon)**2
+
+        # Арксинус и корень считаем только для пар, прошедших порог по a
+        gate = a <= a_max
+        candidates, a = candidates[gate], a[gate]
+        distances = EARTH_RADIUS_KM * (2 * np.arcsin(np.sqrt(a)))
+
+        within = distances <= max_distance_km
+        if within.any():
+            parts_i.append(np.full(np.count_nonzero(within), i, dtype=np.int64))
+            parts_j.append(candidates[within].astype(np.int64))
+            parts_distances.append(distances[within])
+
+    if not parts_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    return np.concatenate(parts_i), np.concatenate(parts_j), np.concatenate(parts_distances)
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _in_window_jit(lon_i, lon_j, dlon_max):
+        dlon = abs(lon_j - lon_i)
+        if dlon > np.float32(math.pi):
+            dlon = np.float32(2 * math.pi) - dlon
+        return dlon <= dlon_max
+
+    @numba.njit(cache=True)
+    def _pair_distance_jit(half_lats, half_lons, cos_lats, i, j, dlon_max, lons32, a_max, max_distance_km):
+        # Пара проверяется всегда в порядке i < j, чтобы расстояние считалось
+        # в точности так же, как в find_pairs_numpy
+        if i > j:
+            i, j = j, i
+        if not _in_window_jit(lons32[i], lons32[j], dlon_max):
+            return -1.0
+        a = math.sin(half_lats[j] - half_lats[i])**2 + cos_lats[i] * cos_lats[j] * math.sin(half_lons[j] - half_lons[i])**2
+        if a > a_max:
+            return -1.0
+        distance = EARTH_RADIUS_KM * (2 * math.asin(math.sqrt(a)))
+        return distance if distance <= max_distance_km else -1.0
+
+    @numba.njit(parallel=True, cache=True)
+    def _find_pairs_jit(half_lats, half_lons, cos_lats, order, window_end, lons32, dlon_max,
+                        a_max, max_distance_km):
+        n = half_lats.shape[0]
+
+        # Аэропорты перебираются в порядке широты: для позиции q кандидаты - только
+        # следующие позиции до верхней границы окна по широте, поэтому каждая пара
+        # просматривается один раз, а перебор строки обрывается сразу за границей.
+        # Первый проход считает пары для каждой позиции, второй - заполняет результат
+        # по вычисленным смещениям, поэтому потокам не нужна синхронизация
+        counts = np.zeros(n, dtype=np.int64)
+        for q in numba.prange(n):
+            i = order[q]
+            count = 0
+            for p in range(q + 1, window_end[i]):
+                if _pair_distance_jit(half_lats, half_lons, cos_lats, i, order[p], dlon_max[i], lons32,
+                                      a_max, max_distance_km) >= 0:
+                    count += 1
+            counts[q] = count
+
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        out_i = np.empty(offsets[n], dtype=np.int64)
+        out_j = np.empty(offsets[n], dtype=np.int64)
+        out_distances = np.empty(offsets[n], dtype=np.float64)
+
+        for q in numba.prange(n):
+            i = order[q]
+            pos = offsets[q]
+            for p in range(q + 1, window_end[i]):
+                j = order[p]
+                distance = _pair_distance_jit(half_lats, half_lons, cos_lats, i, j, dlon_max[i], lons32,
+                                              a_max, max_distance_km)
+                if distance >= 0:
+                    out_i[pos] = min(i, j)
+                    out_j[pos] = max(i, j)
+                    out_distances[pos] = distance
+                    pos += 1
+
+        return out_i, out_j, out_distances
+
+
+def find_pairs_jit(lats: np.ndarray, lons: np.ndarray, cos_lats: np.ndarray,
+                   max_distance_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    То же, что find_pairs_numpy, но пары перебираются скомпилированным numba ядром
+    параллельно по строкам.
+
+    Args:
+        lats, lons: Широты и долготы аэропортов в радианах
+        cos_lats: Косинусы широт
+        max_distance_km: Максимальное расстояние в км
+
+    Returns:
+        Массивы (i, j, расстояние в км), упорядоченные по i, затем по j
+    """
+    order, _, window_end, lons32, dlon_max = search_window(lats, lons, cos_lats, max_distance_km)
+
+    # Половины углов считаем один раз, а не для каждой пары (деление на 2 точное)
+    pair_i, pair_j, pair_distances = _find_pairs_jit(
+        lats / 2, lons / 2, cos_lats, order, window_end, lons32, dlon_max,
+        haversine_threshold(max_distance_km), float(max_distance_km))
+
+    # Ядро выдает пары в порядке широты, восстанавливаем порядок по i, затем по j
+    pair_order = np.lexsort((pair_j, pair_i))
+    return pair_i[pair_order], pair_j[pair_order], pair_distances[pair_order]
+
+
+def airport_columns(airports: Union[pa.Table, List[Dict]], names: List[str]) -> Dict[str, list]:
+    """
+    Извлекает нужные поля аэропортов в виде колонок.
+
+    Из таблицы Arrow колонки берутся целиком, без построчного создания словарей.
+    Для списка словарей отсутствующее поле, как и раньше, заменяется пустой строкой.
+
+    Args:
+        airports: Таблица Arrow или список словарей с данными об аэропортах
+        names: Названия нужных полей
+
+    Returns:
+        Словарь {название поля: список значений}
+    """
+    if isinstance(airports, pa.Table):
+        return {
+            name: airports.column(name).to_pylist() if name in airports.column_names
+            else [""] * airports.num_rows
+            for name in names
+        }
+
+    return {name: [airport.get(name, "") for airport in airports] for name in names}
+
+
+def round_distances(distances: np.ndarray) -> np.ndarray:
+    """
+    Округляет расстояния до сотых векторно, с тем же результатом, что и round(distance, 2).
+
+    np.round умножает значения на 100, и около половины сотой погрешность умножения
+    может изменить результат, поэтому такие значения округляются через round.
+
+    Args:
+        distances: Массив расстояний в км
+
+    Returns:
+        Массив округленных расстояний
+    """
+    rounded = np.round(distances, 2)
+    scaled = distances * 100
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for k in np.flatnonzero(near_half).tolist():
+        rounded[k] = round(float(distances[k]), 2)
+    return rounded
+
+
+def build_airport_network(airports: Union[pa.Table, List[Dict]],
+                          max_distance_km: float = 100) -> Dict[str, Dict]:
     """
     Строит сеть аэропортов, определяя для каждого аэропорта близлежащие аэропорты.
 
     Args:
-        airports: Список аэропортов с координатами
+        airports: Таблица Arrow или список словарей с данными об аэропортах
         max_distance_km: Максимальное расстояние для считывания аэропортов близлежащими (в км)
 
     Returns:
         Словарь {IATA_код: {"name": название, "municipality": город, "country": страна,
-                           "coordinates": "lat, lon", "nearby_airports": [список IATA кодов]}}
+                           "coordinates": "lat, lon", "nearby_idx": массив индексов соседей
+                           в порядке ключей сети, "nearby_distance_km": массив расстояний}}
     """
     print(f"\nСтроим сеть аэропортов (макс. расстояние: {max_distance_km} км)...")
 
@@ -110,45 +461,70 @@ def build_airport_network(airports: List[Dict], max_distance_km: float = 100) ->
     airport_coords = {}
     airport_info = {}
 
-    for airport in airports:
-        iata = airport.get("iata_code")
+    # Поля читаем колонками, а координаты всех аэропортов парсим одним проходом
+    columns = airport_columns(airports, ["iata_code", "coordinates", "name", "municipality", "iso_country"])
+    parsed_lats, parsed_lons, parsed_ok = parse_coordinates_array(columns["coordinates"])
+
+    for iata, coords_str, name, municipality, country, lat, lon, ok in zip(
+            columns["iata_code"], columns["coordinates"], columns["name"], columns["municipality"],
+            columns["iso_country"], parsed_lats.tolist(), parsed_lons.tolist(), parsed_ok.tolist()):
         if not iata:
             continue
 
-        coords_str = airport.get("coordinates", "")
-        lat, lon = parse_coordinates(coords_str)
-        if lat is not None and lon is not None:
+        if ok:
             airport_coords[iata] = (lat, lon)
             airport_info[iata] = {
-                "name": airport.get("name", ""),
-                "municipality": airport.get("municipality", ""),
-                "country": airport.get("iso_country", ""),
+                "name": name,
+                "municipality": municipality,
+                "country": country,
                 "coordinates": coords_str
             }
 
     print(f"Обрабатываем {len(airport_coords)} аэропортов с корректными координатами...")
 
-    # Находим близлежащие аэропорты для каждого
+    # Координаты в радианах складываем в массивы, чтобы считать расстояния
+    # от аэропорта сразу до всех остальных векторно
+    iatas = list(airport_coords)
+    coords = np.array(list(airport_coords.values()), dtype=np.float64).reshape(-1, 2)
+    lats = np.radians(coords[:, 0])
+    lons = np.radians(coords[:, 1])
+
+    # Аэропорты с координатами nan/inf (float() их принимает) остаются в сети без соседей:
+    # пары ищем только среди конечных координат и возвращаем исходные индексы
+    finite = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+    if len(finite) < len(iatas):
+        lats, lons = lats[finite], lons[finite]
+    cos_lats = np.cos(lats)
+
+    if numba is not None:
+        pair_i, pair_j, pair_distances = find_pairs_jit(lats, lons, cos_lats, max_distance_km)
+    else:
+        pair_i, pair_j, pair_distances = find_pairs_numpy(lats, lons, cos_lats, max_distance_km)
+    if len(finite) < len(iatas):
+        pair_i, pair_j = finite[pair_i], finite[pair_j]
+
+    # Расстояние симметрично, поэтому каждая пара i < j найдена один раз:
+    # записываем ее в обе стороны плоскими массивами ребер
+    rounded_distances = round_distances(pair_distances)
+    edge_src = np.concatenate((pair_i, pair_j))
+    edge_dst = np.concatenate((pair_j, pair_i))
+    edge_distances = np.concatenate((rounded_distances, rounded_distances))
+
+    # Ребра группируем по аэропорту, внутри группы сортируем по расстоянию,
+    # а при равном расстоянии - по порядку аэропортов
+    edge_order = np.lexsort((edge_dst, edge_distances, edge_src))
+    edge_dst = edge_dst[edge_order]
+    edge_distances = edge_distances[edge_order]
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(edge_src, minlength=len(iatas)))))
+
+    # Находим близлежащие аэропорты для каждого. Соседи хранятся срезами массивов
+    # (индексы аэропортов в сети и расстояния), а словари для JSON создаются
+    # только при сохранении, см. airport_record
     network = {}
     processed = 0
 
-    for iata1, (lat1, lon1) in airport_coords.items():
-        nearby_with_distances = []
-
-        for iata2, (lat2, lon2) in airport_coords.items():
-            if iata1 == iata2:
-                continue
-
-            distance = haversine_distance(lat1, lon1, lat2, lon2)
-
-            if distance <= max_distance_km:
-                nearby_with_distances.append({
-                    "iata": iata2,
-                    "distance_km": round(distance, 2)
-                })
-
-        # Сортируем по расстоянию
-        nearby_with_distances.sort(key=lambda x: x["distance_km"])
+    for k, iata1 in enumerate(iatas):
+        start, end = bounds[k], bounds[k + 1]
 
         # Создаем запись для этого аэропорта
         network[iata1] = {
@@ -156,7 +532,8 @@ def build_airport_network(airports: List[Dict], max_distance_km: float = 100) ->
             "municipality": airport_info[iata1]["municipality"],
             "country": airport_info[iata1]["country"],
             "coordinates": airport_info[iata1]["coordinates"],
-            "nearby_airports": nearby_with_distances
+            "nearby_idx": edge_dst[start:end],
+            "nearby_distance_km": edge_distances[start:end]
         }
 
         processed += 1
@@ -167,9 +544,33 @@ def build_airport_network(airports: List[Dict], max_distance_km: float = 100) ->
     return network
 
 
+def airport_record(info: Dict, iatas: List[str]) -> Dict:
+    """
+    Преобразует запись аэропорта из build_airport_network в вид для JSON:
+    массивы соседей заменяются списком {"iata": код, "distance_km": расстояние}.
+
+    Args:
+        info: Запись аэропорта
+        iatas: IATA коды аэропортов в порядке ключей сети
+
+    Returns:
+        Запись аэропорта с полем nearby_airports (запись без массивов возвращается как есть)
+    """
+    if "nearby_idx" not in info:
+        return info
+
+    record = {key: value for key, value in info.items()
+              if key not in ("nearby_idx", "nearby_distance_km")}
+    record["nearby_airports"] = [
+        {"iata": iatas[j], "distance_km": distance}
+        for j, distance in zip(info["nearby_idx"].tolist(), info["nearby_distance_km"].tolist())
+    ]
+    return record
+
+
 def save_network(network: Dict, output_file: str = "data/airport_network.json"):
     """
-    Сохраняет сеть аэропортов в JSON файл.
+    Сохраняет сеть аэропортов в JSON файл, записывая его потоково по аэропортам.
 
     Args:
         network: Сеть аэропортов
@@ -178,13 +579,32 @@ def save_network(network: Dict, output_file: str = "data/airport_network.json"):
     output_path = Path(output_file)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(network, f, ensure_ascii=False, indent=2)
+    iatas = list(network)
+
+    # Пишем файл по одному аэропорту, не собирая всю сеть и весь JSON в памяти.
+    # Каждая запись сериализуется с отступом 2 и сдвигается на уровень внутрь,
+    # поэтому файл совпадает с результатом сериализации сети целиком
+    with open(output_path, 'wb') as f:
+        f.write(b"{")
+        for k, (iata, info) in enumerate(network.items()):
+            record = airport_record(info, iatas)
+            if orjson is not None:
+                key = orjson.dumps(iata)
+                value = orjson.dumps(record, option=orjson.OPT_INDENT_2)
+            else:
+                key = json.dumps(iata, ensure_ascii=False).encode('utf-8')
+                value = json.dumps(record, ensure_ascii=False, indent=2).encode('utf-8')
+            f.write(b",\n  " if k else b"\n  ")
+            f.write(key + b": " + value.replace(b"\n", b"\n  "))
+        f.write(b"\n}" if network else b"}")
 
     print(f"\nСеть аэропортов сохранена в {output_file}")
 
     # Выводим статистику
-    total_connections = sum(len(info.get("nearby_airports", [])) for info in network.values())
+    total_connections = sum(
+        len(info["nearby_idx"]) if "nearby_idx" in info else len(info.get("nearby_airports", []))
+        for info in network.values()
+    )
     avg_connections = total_connections / len(network) if network else 0
 
     print(f"\nСтатистика:")
@@ -195,7 +615,7 @@ def save_network(network: Dict, output_file: str = "data/airport_network.json"):
     # Примеры
     print(f"\nПримеры близких аэропортов:")
     for i, (iata, info) in enumerate(list(network.items())[:5]):
-        nearby_list = info.get("nearby_airports", [])
+        nearby_list = airport_record(info, iatas).get("nearby_airports", [])
         if nearby_list:
             print(f"  {iata} ({info['municipality']}, {info['country']}):")
             for neighbor_item in nearby_list[:3]:
@@ -206,6 +626,94 @@ def save_network(network: Dict, output_file: str = "data/airport_network.json"):
                     print(f"    - {neighbor_iata} ({neighbor_info['municipality']}, {neighbor_info['country']}): {neighbor_distance} км")
 
 
+def save_network_parquet(network: Dict, output_dir: str = "data"):
+    """
+    Сохраняет сеть аэропортов в Parquet: таблицу аэропортов (airports.parquet)
+    и таблицу связей (airport_edges.parquet) с колонками src, dst, distance_km.
+
+    Args:
+        network: Сеть аэропортов
+        output_dir: Каталог для Parquet файлов
+    """
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    infos = list(network.values())
+    lats, lons, _ = parse_coordinates_array([info.get("coordinates") for info in infos])
+    airports_table = pa.table({
+        "iata": list(network),
+        "name": [info.get("name") for info in infos],
+        "municipality": [info.get("municipality") for info in infos],
+        "country": [info.get("country") for info in infos],
+        "coordinates": [info.get("coordinates") for info in infos],
+        "lat": lats,
+        "lon": lons
+    })
+
+    # Связи храним плоскими колонками в порядке списков соседей
+    iatas = np.array(list(network), dtype=object)
+    dst_parts, distance_parts, counts = [], [], []
+    for info in infos:
+        if "nearby_idx" in info:
+            nearby_iatas = iatas[info["nearby_idx"]]
+            nearby_distances = info["nearby_distance_km"]
+        else:
+            nearby = info.get("nearby_airports", [])
+            nearby_iatas = [neighbor_item["iata"] for neighbor_item in nearby]
+            nearby_distances = [neighbor_item["distance_km"] for neighbor_item in nearby]
+        dst_parts.append(np.asarray(nearby_iatas, dtype=object))
+        distance_parts.append(np.asarray(nearby_distances, dtype=np.float64))
+        counts.append(len(nearby_iatas))
+
+    src = np.repeat(iatas, counts)
+    dst = np.concatenate(dst_parts) if dst_parts else np.array([], dtype=object)
+    distances = np.concatenate(distance_parts) if distance_parts else np.array([], dtype=np.float64)
+    edges_table = pa.table({
+        "src": pa.array(src, type=pa.string()),
+        "dst": pa.array(dst, type=pa.string()),
+        "distance_km": pa.array(distances, type=pa.float64())
+    })
+
+    pq.write_table(airports_table, output_path / "airports.parquet", compression="zstd")
+    pq.write_table(edges_table, output_path / "airport_edges.parquet", compression="zstd")
+
+    print(f"Сеть аэропортов сохранена в Parquet: {output_path / 'airports.parquet'}, "
+          f"{output_path / 'airport_edges.parquet'}")
+
+
+def load_network_parquet(input_dir: str = "data") -> Dict[str, Dict]:
+    """
+    Загружает сеть аэропортов из Parquet файлов, сохраненных save_network_parquet,
+    в том же виде, что и JSON файл сети.
+
+    Args:
+        input_dir: Каталог с Parquet файлами
+
+    Returns:
+        Словарь с сетью аэропортов
+    """
+    input_path = Path(input_dir)
+    airports = pq.read_table(input_path / "airports.parquet").to_pydict()
+    edges = pq.read_table(input_path / "airport_edges.parquet").to_pydict()
+
+    network = {}
+    for iata, name, municipality, country, coordinates in zip(
+            airports["iata"], airports["name"], airports["municipality"],
+            airports["country"], airports["coordinates"]):
+        network[iata] = {
+            "name": name,
+            "municipality": municipality,
+            "country": country,
+            "coordinates": coordinates,
+            "nearby_airports": []
+        }
+
+    for src, dst, distance in zip(edges["src"], edges["dst"], edges["distance_km"]):
+        network[src]["nearby_airports"].append({"iata": dst, "distance_km": distance})
+
+    return network
+
+
 def main():
     """Основная функция."""
     import argparse
@@ -223,14 +731,32 @@ def main():
         default="data/airport_network.json",
         help="Путь к выходному файлу (по умолчанию: data/airport_network.json)"
     )
+    parser.add_argument(
+        "--parquet-dir",
+        type=str,
+        default=None,
+        help="Дополнительно сохранить сеть в Parquet (airports.parquet и airport_edges.parquet) в этот каталог"
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default="data/airports_cache.parquet",
+        help="Путь к кэшу датасета аэропортов (по умолчанию: data/airports_cache.parquet)"
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Заново загрузить датасет из HuggingFace и обновить кэш"
+    )
 
     args = parser.parse_args()
 
     try:
         # Загружаем данные об аэропортах
-        airports = fetch_airports_from_huggingface()
+        airports = fetch_airports_from_huggingface(cache_file=args.cache,
+                                                   refresh_cache=args.refresh_cache)
 
-        if not airports:
+        if airports.num_rows == 0:
             print("Не удалось загрузить данные об аэропортах")
             return 1
 
@@ -241,6 +767,8 @@ def main():
 
         # Сохраняем результат
         save_network(network, output_file=args.output)
+        if args.parquet_dir:
+            save_network_parquet(network, output_dir=args.parquet_dir)
 
         return 0
 
@@ -8,14 +8,41 @@
 import os
 import sys
 import json
-import requests
+import gzip
+import random
+import shutil
+import sqlite3
+import tempfile
+import itertools
+import asyncio
+import importlib.util
+import aiohttp
 import argparse
+import threading
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Union, AsyncIterator, Set, BinaryIO
 from pathlib import Path
 from dotenv import load_dotenv
 import time
 
+try:
+    import orjson
+except ImportError:  # без orjson результат сериализуется стандартным json
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # без zstandard результат можно сжать только в .gz
+    zstandard = None
+
+try:
+    import httpx
+except ImportError:  # без httpx запросы выполняются через aiohttp (только HTTP/1.1)
+    httpx = None
+
+# HTTP/2 в httpx требует пакета h2
+HTTP2_AVAILABLE = httpx is not None and importlib.util.find_spec("h2") is not None
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -26,6 +53,240 @@ if not API_TOKEN:
     print("Ошибка: TRAVELPAYOUTS_TOKEN не найден в .env файле")
     sys.exit(1)
 
+# Ограничение частоты запросов к API (в среднем и подряд без ожидания)
+# и число параллельных запросов по умолчанию
+REQUESTS_PER_SECOND = 5
+REQUESTS_BURST = 5
+MAX_WORKERS = 8
+
+# Поля рейсов, которые используются при анализе (aggregate_flights.py);
+# остальные поля ответа API по умолчанию не сохраняются
+FLIGHT_FIELDS = ("origin", "destination", "departure_at", "arrival_at", "duration",
+                 "price", "value", "airline", "flight_number", "link")
+
+# Время жизни записей кэша ответов API между запусками (в секундах; кэш включается --cache-file)
+# и число новых ответов, после которого они записываются в файл кэша одной транзакцией
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_BATCH = 200
+
+# Повтор запросов, завершившихся сетевой ошибкой или ответом 429/5xx
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_MAX_DELAY = 30
+
+# Ответы API на некорректный запрос (например, неизвестный код города или неверный токен)
+INVALID_REQUEST_STATUSES = (400, 401, 403)
+
+# Сколько байт рейсов второго этапа держится в памяти, пока в файл пишется первый этап;
+# остальное временно сохраняется на диск
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# Сколько раз за этап выводится прогресс сбора (если не включен подробный вывод)
+PROGRESS_STEPS = 10
+
+# Сетевые ошибки асинхронных клиентов, после которых запрос повторяется
+ASYNC_HTTP_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+if httpx is not None:
+    ASYNC_HTTP_ERRORS += (httpx.HTTPError,)
+
+
+class RateLimiter:
+    """
+    Ограничивает частоту запросов, выполняемых из нескольких потоков или задач,
+    по схеме token bucket: токены пополняются с заданной частотой, а накопленный
+    запас (не больше burst) позволяет выполнить несколько запросов подряд без ожидания.
+    """
+
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        """
+        Args:
+            requests_per_second: Максимальное число запросов в секунду (0 - без ограничения)
+            burst: Максимальное число запросов, выполняемых подряд без ожидания
+        """
+        self._lock = threading.Lock()
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self.set_rate(requests_per_second)
+
+    def set_rate(self, requests_per_second: float):
+        """
+        Меняет ограничение частоты запросов.
+
+        Args:
+            requests_per_second: Максимальное число запросов в секунду (0 - без ограничения)
+        """
+        self._rate = max(0.0, requests_per_second)
+
+    def _reserve(self) -> float:
+        """
+        Забирает токен для следующего запроса. Если токенов нет, токен берется
+        в долг, и запрос ждет, пока долг не будет пополнен.
+
+        Returns:
+            Сколько секунд нужно подождать перед запросом
+        """
+        if self._rate == 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+    async def wait_async(self):
+        """Ждет, пока можно будет выполнить следующий запрос, не блокируя цикл событий."""
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+rate_limiter = RateLimiter(REQUESTS_PER_SECOND, REQUESTS_BURST)
+
+
+class ResponseCache:
+    """
+    Кэш успешных ответов API по параметрам запроса (без токена).
+
+    В памяти хранятся только ответы, сохраненные с keep_in_memory (проверочные
+    запросы check_routes), и только до первого чтения: сбор повторяет каждый
+    такой запрос один раз. Если кэш открыт через open, ответы дополнительно
+    сохраняются в SQLite файл и переиспользуются следующими запусками, пока не истечет ttl.
+    """
+
+    def __init__(self):
+        self._memory = {}
+        self._db = None
+        self._ttl = 0.0
+        self._pending = []
+
+    def open(self, cache_file: Optional[str], ttl: float):
+        """
+        Подключает кэш в SQLite файле и удаляет из него устаревшие записи.
+
+        Args:
+            cache_file: Путь к файлу кэша (None - кэш между запусками не используется)
+            ttl: Время жизни записей в секундах (0 - кэш между запусками не используется)
+        """
+        self.close()
+        self._ttl = ttl
+        if not cache_file or ttl <= 0:
+            return
+
+        cache_path = Path(cache_file)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(cache_path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                         "(key TEXT PRIMARY KEY, body BLOB NOT NULL, stored_at REAL NOT NULL)")
+        self._db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - ttl,))
+        self._db.commit()
+
+    def _flush(self):
+        """Записывает накопленные ответы в файл кэша одной транзакцией."""
+        if self._pending:
+            self._db.executemany("INSERT OR REPLACE INTO responses (key, body, stored_at) VALUES (?, ?, ?)",
+                                 self._pending)
+            self._db.commit()
+            self._pending = []
+
+    def close(self):
+        """Записывает оставшиеся ответы и закрывает файл кэша."""
+        if self._db is not None:
+            self._flush()
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def _key(params: Dict[str, Any]) -> str:
+        """Строит ключ кэша из параметров запроса без токена."""
+        return json.dumps({name: value for name, value in params.items() if name != "token"},
+                          sort_keys=True)
+
+    def get(self, params: Dict[str, Any]) -> Optional[bytes]:
+        """
+        Возвращает сохраненный ответ на запрос.
+
+        Args:
+            params: Параметры запроса
+
+        Returns:
+            Тело ответа или None, если ответа нет в кэше
+        """
+        key = self._key(params)
+        body = self._memory.pop(key, None)
+        if body is None and self._db is not None:
+            row = self._db.execute("SELECT body FROM responses WHERE key = ? AND stored_at >= ?",
+                                   (key, time.time() - self._ttl)).fetchone()
+            if row is not None:
+                body = row[0]
+        return body
+
+    def put(self, params: Dict[str, Any], body: bytes, keep_in_memory: bool = False):
+        """
+        Сохраняет успешный ответ на запрос.
+
+        Args:
+            params: Параметры запроса
+            body: Тело ответа
+            keep_in_memory: Хранить ответ в памяти до первого чтения через get
+        """
+        key = self._key(params)
+        if keep_in_memory:
+            self._memory[key] = body
+        if self._db is not None:
+            # Коммит на каждый ответ блокировал бы цикл событий, поэтому ответы пишутся пачками
+            self._pending.append((key, body, time.time()))
+            if len(self._pending) >= RESPONSE_CACHE_BATCH:
+                self._flush()
+
+
+response_cache = ResponseCache()
+
+
+def create_async_client(max_workers: int = MAX_WORKERS) -> Union["httpx.AsyncClient", aiohttp.ClientSession]:
+    """
+    Создает асинхронный HTTP клиент. Вызывается внутри работающего цикла событий.
+
+    Если установлен httpx, используется он, а при наличии пакета h2 - HTTP/2:
+    параллельные запросы к API мультиплексируются в одном TCP+TLS соединении.
+    Иначе используется aiohttp с пулом keep-alive соединений.
+
+    Args:
+        max_workers: Число параллельных запросов
+
+    Returns:
+        Клиент httpx.AsyncClient или aiohttp.ClientSession
+    """
+    if httpx is None:
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max_workers),
+                                     timeout=aiohttp.ClientTimeout(total=10))
+
+    transport = httpx.AsyncHTTPTransport(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+        # Повторы выполняет fetch_flights_async с паузой из retry_delay, транспорт не повторяет сам
+        retries=0
+    )
+    return httpx.AsyncClient(transport=transport, timeout=10)
+
+
+def json_loads(raw: bytes) -> Any:
+    """
+    Разбирает JSON из байтов, используя orjson, если он установлен.
+
+    Args:
+        raw: Тело ответа API
+
+    Returns:
+        Разобранные данные
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
 
 def get_date_range(start_date: str, end_date: str) -> List[str]:
     """
@@ -38,22 +299,17 @@ def get_date_range(start_date: str, end_date: str) -> List[str]:
     Returns:
         Список дат в формате YYYY-MM-DD
     """
-    start = datetime.strptime(start_date, "%Y-%m-%d")
-    end = datetime.strptime(end_date, "%Y-%m-%d")
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
 
-    dates = []
-    current = start
-    while current <= end:
-        dates.append(current.strftime("%Y-%m-%d"))
-        current += timedelta(days=1)
+    # Диапазон строим одним списковым выражением; isoformat у date дает YYYY-MM-DD без strftime
+    return [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
 
-    return dates
 
-
-def fetch_flights(origin: str = None, destination: str = None, departure_at: str = None,
-                  currency: str = "RUB", unique: bool = True, limit: int = 1000) -> Dict[str, Any]:
+def build_params(origin: str = None, destination: str = None, departure_at: str = None,
+                 currency: str = "RUB", unique: bool = True, limit: int = 1000) -> Dict[str, Any]:
     """
-    Получает данные о перелетах из API.
+    Формирует параметры запроса к API.
 
     Args:
         origin: Код города отправления (IATA), опционально
@@ -64,7 +320,7 @@ def fetch_flights(origin: str = None, destination: str = None, departure_at: str
         limit: Лимит результатов (по умолчанию 1000)
 
     Returns:
-        Словарь с данными о перелетах
+        Словарь с параметрами запроса
     """
     params = {
         "currency": currency,
@@ -86,107 +342,646 @@ def fetch_flights(origin: str = None, destination: str = None, departure_at: str
     if departure_at:
         params["departure_at"] = departure_at
 
-    try:
-        response = requests.get(API_BASE_URL, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        origin_str = origin or "ANY"
-        dest_str = destination or "ANY"
-        print(f"Ошибка при запросе {origin_str} -> {dest_str} на {departure_at}: {e}")
-        return {"data": []}
+    return params
 
 
-def collect_leg_data(origin: str = None, destination: str = None,
-                     date_range: List[str] = None, leg_name: str = "") -> List[Dict[str, Any]]:
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
     """
-    Собирает данные о перелетах для одного этапа маршрута.
-    Если origin указан, а destination нет - получает все направления из origin.
-    Если destination указан, а origin нет - получает все направления в destination.
+    Считает паузу перед повтором запроса: экспоненциальная задержка со случайной
+    добавкой, чтобы параллельные запросы не повторялись одновременно.
+    Если сервер прислал Retry-After в секундах, ждем не меньше указанного.
+
+    Args:
+        attempt: Номер неудачной попытки, начиная с 0
+        retry_after: Значение заголовка Retry-After, если есть
+
+    Returns:
+        Пауза в секундах (не больше RETRY_MAX_DELAY)
+    """
+    delay = RETRY_BACKOFF * 2 ** attempt + random.uniform(0, RETRY_BACKOFF)
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(delay, RETRY_MAX_DELAY)
+
+
+async def get_async(client: Union["httpx.AsyncClient", aiohttp.ClientSession],
+                    params: Dict[str, Any]) -> Tuple[int, Optional[str], bytes]:
+    """
+    Выполняет GET запрос к API через асинхронный клиент.
+
+    Args:
+        client: Клиент httpx.AsyncClient или aiohttp.ClientSession
+        params: Параметры запроса
+
+    Returns:
+        Кортеж (код ответа, заголовок Retry-After, тело ответа)
+    """
+    if isinstance(client, aiohttp.ClientSession):
+        async with client.get(API_BASE_URL, params=params) as response:
+            return response.status, response.headers.get("Retry-After"), await response.read()
+
+    response = await client.get(API_BASE_URL, params=params)
+    return response.status_code, response.headers.get("Retry-After"), response.content
+
+
+async def fetch_flights_async(client: Union["httpx.AsyncClient", aiohttp.ClientSession],
+                              origin: str = None, destination: str = None,
+                              departure_at: str = None, currency: str = "RUB",
+                              unique: bool = True, limit: int = 1000,
+                              raise_invalid: bool = False, keep_in_memory: bool = False) -> Dict[str, Any]:
+    """
+    Асинхронно получает данные о перелетах из API.
+
+    Запросы, завершившиеся сетевой ошибкой или ответом 429/5xx, повторяются
+    до MAX_RETRIES раз с паузой из retry_delay. Успешные ответы сохраняются
+    в response_cache (см. ResponseCache).
 
     Args:
+        client: Клиент httpx.AsyncClient или aiohttp.ClientSession
         origin: Код города отправления (IATA), опционально
         destination: Код города назначения (IATA), опционально
-        date_range: Список дат для проверки
-        leg_name: Название этапа (для логирования)
+        departure_at: Дата вылета в формате YYYY-MM-DD
+        currency: Валюта цен (по умолчанию RUB)
+        unique: Уникальные направления (по умолчанию True)
+        limit: Лимит результатов (по умолчанию 1000)
+        raise_invalid: Выбрасывать ValueError, если API отклонил запрос как некорректный
+        keep_in_memory: Хранить ответ в памяти до такого же запроса при сборе
 
     Returns:
-        Список всех найденных перелетов
+        Словарь с данными о перелетах
     """
-    all_flights = []
-    total_requests = len(date_range) if date_range else 1
-    current_request = 0
-
+    params = build_params(origin, destination, departure_at, currency, unique, limit)
     origin_str = origin or "ANY"
     dest_str = destination or "ANY"
 
+    cached = response_cache.get(params)
+    if cached is not None:
+        return json_loads(cached)
+
+    for attempt in range(MAX_RETRIES + 1):
+        await rate_limiter.wait_async()
+        retry_after = None
+        try:
+            status, retry_after, body = await get_async(client, params)
+        except ASYNC_HTTP_ERRORS as e:
+            error = e
+        else:
+            if status < 400:
+                try:
+                    result = json_loads(body)
+                    response_cache.put(params, body, keep_in_memory)
+                    return result
+                except ValueError as e:
+                    error = e
+                    break
+            error = f"HTTP {status}"
+            if raise_invalid and status in INVALID_REQUEST_STATUSES:
+                raise ValueError(f"{error}: {body[:200].decode('utf-8', 'replace')}")
+            if status not in RETRY_STATUSES:
+                break
+
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+
+    print(f"Ошибка при запросе {origin_str} -> {dest_str} на {departure_at}: {error}")
+    return {"data": []}
+
+
+class InvalidRoutesError(Exception):
+    """API отклонил проверочные запросы: коды городов или токен некорректны."""
+
+    def __init__(self, errors: List[str]):
+        """
+        Args:
+            errors: Описания отклоненных кодов и запросов
+        """
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+async def check_routes(client: Union["httpx.AsyncClient", aiohttp.ClientSession],
+                       legs: List[Tuple[List[Tuple[Optional[str], Optional[str]]], Optional[List[str]]]]) -> List[str]:
+    """
+    Проверяет коды городов до начала сбора, чтобы опечатка в коде не обернулась
+    сотнями пустых запросов к API.
+
+    Для каждого кода выполняется один запрос из тех, что понадобятся при сборе
+    (маршрут с этим кодом на первую дату этапа). Ответы сохраняются в response_cache,
+    поэтому при сборе эти запросы повторно не выполняются.
+
+    Args:
+        client: Клиент httpx.AsyncClient или aiohttp.ClientSession
+        legs: Список этапов (маршруты, даты)
+
+    Returns:
+        Список ошибок для отклоненных кодов и запросов (пустой, если все в порядке)
+    """
+    errors = []
+    checked = set()
+    probes = []
+    for routes, dates in legs:
+        for origin, destination in routes:
+            codes = {origin, destination} - {None}
+            if codes <= checked:
+                continue
+            checked |= codes
+
+            # Коды некорректного вида отклоняем без запроса к API
+            bad_codes = [code for code in codes if not (len(code) == 3 and code.isascii() and code.isalpha())]
+            if bad_codes:
+                errors.extend(f"{code}: код города должен состоять из 3 латинских букв" for code in bad_codes)
+                continue
+            probes.append((origin, destination, dates[0] if dates else None))
+
+    results = await asyncio.gather(*(fetch_flights_async(client, origin, destination, date,
+                                                         raise_invalid=True, keep_in_memory=True)
+                                     for origin, destination, date in probes),
+                                   return_exceptions=True)
+    for (origin, destination, date), result in zip(probes, results):
+        if isinstance(result, ValueError):
+            errors.append(f"{origin or 'ANY'} -> {destination or 'ANY'}: {result}")
+        elif isinstance(result, Exception):
+            raise result
+    return errors
+
+
+async def collect_leg_data(client: Union["httpx.AsyncClient", aiohttp.ClientSession],
+                           routes: List[Tuple[Optional[str], Optional[str]]],
+                           date_range: List[str] = None, leg_name: str = "",
+                           max_workers: int = MAX_WORKERS,
+                           fields: Optional[Tuple[str, ...]] = FLIGHT_FIELDS,
+                           verbose: bool = False) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Собирает данные о перелетах для одного этапа маршрута.
+    Если в маршруте указан origin, а destination нет - получает все направления из origin.
+    Если указан destination, а origin нет - получает все направления в destination.
+
+    Запросы для пар (маршрут, дата) выполняют параллельно max_workers обработчиков,
+    получающих задания из ограниченной очереди, а рейсы отдаются по мере получения
+    ответов API, порциями в порядке маршрутов и дат. Поэтому ни задания, ни рейсы
+    всего этапа не накапливаются в памяти.
+
+    Args:
+        client: Клиент httpx.AsyncClient или aiohttp.ClientSession
+        routes: Список маршрутов (origin, destination); None - любой город
+        date_range: Список дат для проверки (None - запрос без даты)
+        leg_name: Название этапа (для логирования)
+        max_workers: Число параллельных запросов
+        fields: Сохраняемые поля рейсов (None - все поля ответа API)
+        verbose: Выводить результат каждого запроса, иначе только периодический прогресс
+
+    Yields:
+        Списки найденных перелетов для очередной пары (маршрут, дата)
+    """
+    dates = date_range or [None]
+    total_requests = len(routes) * len(dates)
+    total_flights = 0
+    found_flights = 0
+    current_request = 0
+    progress_every = max(1, total_requests // PROGRESS_STEPS)
+    # Этапы собираются одновременно, поэтому в строках прогресса указываем этап
+    progress_prefix = f"{leg_name} " if leg_name else ""
+
     print(f"\n{'='*60}")
     print(f"Сбор данных для этапа: {leg_name}")
-    print(f"Маршрут: {origin_str} -> {dest_str}")
+    route_strs = [f"{origin or 'ANY'} -> {destination or 'ANY'}" for origin, destination in routes]
+    print(f"Маршрут: {', '.join(route_strs)}")
     if date_range:
         print(f"Диапазон дат: {date_range[0]} - {date_range[-1]}")
     print(f"Всего запросов: {total_requests}")
     print(f"{'='*60}\n")
 
-    if date_range:
-        for date in date_range:
+    # Задания (номер, (маршрут, дата)) попадают в очередь по мере ее освобождения,
+    # частоту запросов обработчиков ограничивает rate_limiter
+    job_queue = asyncio.Queue(maxsize=2 * max_workers)
+    result_queue = asyncio.Queue()
+
+    async def put_jobs():
+        for job in enumerate(itertools.product(routes, dates)):
+            await job_queue.put(job)
+        for _ in range(max_workers):
+            await job_queue.put(None)
+
+    async def fetch_jobs():
+        while True:
+            job = await job_queue.get()
+            if job is None:
+                return
+            k, ((origin, destination), date) = job
+            try:
+                result = await fetch_flights_async(client, origin, destination, date)
+            except Exception as e:
+                # Передаем ошибку в основной цикл, иначе он будет ждать ответа бесконечно
+                result = e
+            await result_queue.put((job, result))
+
+    tasks = [asyncio.ensure_future(put_jobs())]
+    tasks += [asyncio.ensure_future(fetch_jobs()) for _ in range(max_workers)]
+
+    results = {}
+    next_job = 0
+    try:
+        for _ in range(total_requests):
+            job, result = await result_queue.get()
+            if isinstance(result, Exception):
+                raise result
+            results[job[0]] = (job, result)
+
             current_request += 1
-            print(f"[{current_request}/{total_requests}] Запрос: {origin_str} -> {dest_str} на {date}...", end=" ")
+            flight_count = len(result.get("data") or [])
+            found_flights += flight_count
+            if verbose:
+                _, ((origin, destination), date) = job
+                request_str = f"{origin or 'ANY'} -> {destination or 'ANY'}" + (f" на {date}" if date else "")
+                if flight_count:
+                    print(f"[{progress_prefix}{current_request}/{total_requests}] {request_str}: "
+                          f"✓ Найдено {flight_count} рейс(ов)")
+                else:
+                    print(f"[{progress_prefix}{current_request}/{total_requests}] {request_str}: ✗ Рейсов не найдено")
+            elif current_request % progress_every == 0 or current_request == total_requests:
+                # Без подробного вывода печатаем прогресс не чаще PROGRESS_STEPS раз за этап
+                print(f"[{progress_prefix}{current_request}/{total_requests}] Найдено {found_flights} рейс(ов)")
 
-            result = fetch_flights(origin, destination, date)
+            # Отдаем рейсы в порядке запросов, независимо от порядка их завершения:
+            # ответ ждет в results только до прихода ответов на все предыдущие запросы
+            while next_job in results:
+                (_, ((origin, destination), date)), result = results.pop(next_job)
+                flights = result.get("data") or []
+                next_job += 1
 
-            if result.get("data"):
-                flight_count = len(result["data"])
-                print(f"✓ Найдено {flight_count} рейс(ов)")
+                # Оставляем только нужные поля (отсутствующие в ответе не добавляем)
+                if fields is not None:
+                    flights = [{name: flight[name] for name in fields if name in flight} for flight in flights]
 
                 # Добавляем метаданные к каждому рейсу
-                for flight in result["data"]:
+                for flight in flights:
                     flight["leg"] = leg_name
                     flight["search_origin"] = origin
                     flight["search_destination"] = destination
-                    flight["search_date"] = date
-                    all_flights.append(flight)
-            else:
-                print("✗ Рейсов не найдено")
+                    if date:
+                        flight["search_date"] = date
+                total_flights += len(flights)
+                yield flights
+    finally:
+        # Останавливаем обработчики, в том числе если сбор этапа прерван
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f"\nИтого найдено {total_flights} рейс(ов) для этапа {leg_name}\n")
+
+
+def open_output_file(path: Path, compression: str = "") -> BinaryIO:
+    """
+    Открывает файл на запись в двоичном режиме, при необходимости со сжатием.
+
+    Args:
+        path: Путь к файлу
+        compression: Расширение итогового файла: ".gz" - gzip, ".zst" - zstd, иначе без сжатия
+
+    Returns:
+        Файловый объект для записи
+    """
+    if compression == ".gz":
+        return gzip.open(path, 'wb', compresslevel=6)
+    if compression == ".zst":
+        if zstandard is None:
+            raise ImportError("Для сжатия результата в .zst установите пакет zstandard")
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+class FlightsWriter:
+    """
+    Потоково записывает результат сбора в JSON файл: списки рейсов пишутся
+    по мере получения ответов API, а не собираются в памяти целиком.
+
+    Файл форматируется с отступом 2, как при сериализации результата целиком.
+    Поля из write_header_value (метаданные) записываются в начало файла, хотя
+    известны только в конце сбора: остальные поля до закрытия пишутся во временный
+    файл и копируются в результат после заголовка. Поэтому при потоковом чтении
+    метаданные находятся без разбора всего файла.
+    Если имя файла оканчивается на .gz или .zst, результат сжимается.
+    Пока запись не завершена, данные пишутся во временный файл с суффиксом .part,
+    поэтому прерванный сбор не оставляет обрезанный JSON под итоговым именем.
+    """
+
+    def __init__(self, output_file: str):
+        """
+        Args:
+            output_file: Путь к выходному файлу
+        """
+        self.output_path = Path(output_file)
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._part_path = self.output_path.with_name(self.output_path.name + ".part")
+        self._file = open_output_file(self._part_path, self.output_path.suffix)
+        # Поля после заголовка до закрытия хранятся во временном файле рядом с результатом
+        self._body = tempfile.TemporaryFile(dir=self.output_path.parent)
+        self._header = []
+        self._items = 0
+
+    @staticmethod
+    def _dumps(value: Any) -> bytes:
+        """Сериализует значение в JSON с отступом 2."""
+        if orjson is not None:
+            return orjson.dumps(value, option=orjson.OPT_INDENT_2)
+        return json.dumps(value, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def _write_key(self, key: str):
+        """Записывает ключ очередного поля верхнего уровня."""
+        # Запятая ставится перед каждым полем, перед первым полем файла она убирается в close
+        self._body.write(b",\n  " + self._dumps(key) + b": ")
+
+    def write_value(self, key: str, value: Any):
+        """
+        Записывает поле верхнего уровня целиком.
+
+        Args:
+            key: Название поля
+            value: Значение поля
+        """
+        self._write_key(key)
+        self._body.write(self._dumps(value).replace(b"\n", b"\n  "))
+
+    def write_header_value(self, key: str, value: Any):
+        """
+        Задает поле верхнего уровня, которое записывается в начало файла.
+
+        Args:
+            key: Название поля
+            value: Значение поля
+        """
+        self._header.append((key, value))
+
+    def begin_list(self, key: str):
+        """
+        Начинает поле верхнего уровня со списком, элементы которого пишутся через write_items.
+
+        Args:
+            key: Название поля
+        """
+        self._write_key(key)
+        self._body.write(b"[")
+        self._items = 0
+
+    @classmethod
+    def _write_list_items(cls, file: BinaryIO, items: List[Dict[str, Any]], written: int) -> int:
+        """
+        Записывает элементы списка в файл с отступом 4.
+
+        Args:
+            file: Файл для записи
+            items: Элементы списка
+            written: Сколько элементов списка уже записано
+
+        Returns:
+            Число записанных элементов списка с учетом новых
+        """
+        for item in items:
+            file.write(b",\n    " if written else b"\n    ")
+            file.write(cls._dumps(item).replace(b"\n", b"\n    "))
+            written += 1
+        return written
+
+    def write_items(self, items: List[Dict[str, Any]]):
+        """
+        Дописывает элементы в текущий список.
+
+        Args:
+            items: Элементы списка
+        """
+        self._items = self._write_list_items(self._body, items, self._items)
+
+    def end_list(self):
+        """Завершает текущий список."""
+        self._body.write(b"\n  ]" if self._items else b"]")
+
+    def write_list(self, key: str, spool: "SpooledList"):
+        """
+        Записывает поле верхнего уровня со списком, собранным заранее в SpooledList.
+
+        Args:
+            key: Название поля
+            spool: Заранее сериализованные элементы списка
+        """
+        self.begin_list(key)
+        spool.copy_to(self._body)
+        self._items = spool.count
+        self.end_list()
+
+    def close(self):
+        """Записывает заголовок и остальные поля и переименовывает временный файл в итоговый."""
+        self._file.write(b"{")
+        for k, (key, value) in enumerate(self._header):
+            self._file.write(b",\n  " if k else b"\n  ")
+            self._file.write(self._dumps(key) + b": " + self._dumps(value).replace(b"\n", b"\n  "))
+
+        has_body = self._body.tell() > 0
+        self._body.seek(0)
+        if not self._header:
+            # Заголовка нет: убираем запятую перед первым полем
+            self._body.read(1)
+        shutil.copyfileobj(self._body, self._file)
+        self._file.write(b"\n}" if self._header or has_body else b"}")
+
+        self._body.close()
+        self._file.close()
+        self._part_path.replace(self.output_path)
+
+    def __enter__(self) -> "FlightsWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Незавершенный файл не оставляем
+            self._body.close()
+            self._file.close()
+            self._part_path.unlink()
+
+
+class SpooledList:
+    """
+    Список элементов, сериализованных для FlightsWriter.write_list, пока в файл
+    результата пишется другой список. Небольшой список хранится в памяти,
+    большой - во временном файле.
+    """
+
+    def __init__(self, max_size: int = SPOOL_MAX_SIZE):
+        """
+        Args:
+            max_size: Объем данных в байтах, после которого они переносятся на диск
+        """
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.count = 0
+
+    def write_items(self, items: List[Dict[str, Any]]):
+        """
+        Дописывает элементы в список.
+
+        Args:
+            items: Элементы списка
+        """
+        self.count = FlightsWriter._write_list_items(self._file, items, self.count)
+
+    def copy_to(self, file: BinaryIO):
+        """Копирует сериализованные элементы в файл."""
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, file)
+
+    def close(self):
+        """Удаляет временные данные."""
+        self._file.close()
+
+
+async def collect_legs(args: argparse.Namespace, leg1_dates: List[str], leg2_dates: Optional[List[str]],
+                       writer: FlightsWriter) -> Tuple[int, int, Set[str]]:
+    """
+    Собирает данные о перелетах для обоих этапов маршрута через один HTTP клиент
+    и записывает рейсы в списки leg1_flights и leg2_flights.
+
+    Этапы собираются одновременно, общую частоту запросов ограничивает rate_limiter.
+    Рейсы первого этапа записываются в файл по мере получения, а рейсы второго
+    до окончания первого этапа накапливаются в SpooledList.
+
+    Args:
+        args: Аргументы командной строки
+        leg1_dates: Даты первого этапа
+        leg2_dates: Даты второго этапа (None, если второй этап не нужен)
+        writer: Файл результата
+
+    Returns:
+        Кортеж (число рейсов первого этапа, число рейсов второго этапа,
+                аэропорты назначения рейсов первого этапа)
 
-            # Небольшая задержка для избежания rate limiting
-            time.sleep(0.5)
+    Raises:
+        InvalidRoutesError: Если API отклонил проверку кодов городов (см. check_routes)
+    """
+    # Сбор данных для первого этапа
+    if args.intermediate:
+        # Старый способ: перебираем указанные промежуточные города
+        leg1_routes = [(args.origin, intermediate) for intermediate in args.intermediate]
     else:
-        # Запрос без указания конкретной даты
-        print(f"Запрос: {origin_str} -> {dest_str}...", end=" ")
-        result = fetch_flights(origin, destination)
-
-        if result.get("data"):
-            flight_count = len(result["data"])
-            print(f"✓ Найдено {flight_count} рейс(ов)")
-
-            for flight in result["data"]:
-                flight["leg"] = leg_name
-                flight["search_origin"] = origin
-                flight["search_destination"] = destination
-                all_flights.append(flight)
+        # Новый способ: получаем все направления из origin
+        # (не указываем destination - получим все направления)
+        leg1_routes = [(args.origin, None)]
+
+    # Сбор данных для второго этапа (если нужен)
+    leg2_routes = []
+    if args.destination and leg2_dates:
+        if args.intermediate:
+            # Старый способ: из указанных промежуточных городов в destination
+            leg2_routes = [(intermediate, args.destination) for intermediate in args.intermediate]
         else:
-            print("✗ Рейсов не найдено")
+            # Новый способ: все направления в destination
+            # (не указываем origin - получим все направления)
+            leg2_routes = [(None, args.destination)]
+
+    # Одинаковые маршруты (например, повторенный промежуточный город) запрашиваем один раз
+    leg1_routes = list(dict.fromkeys(leg1_routes))
+    leg2_routes = list(dict.fromkeys(leg2_routes))
+
+    discovered_airports = set()
+    client = create_async_client(args.workers)
+    if isinstance(client, aiohttp.ClientSession):
+        print("HTTP клиент: aiohttp (HTTP/1.1)")
+    else:
+        print(f"HTTP клиент: httpx ({'HTTP/2' if HTTP2_AVAILABLE else 'HTTP/1.1, для HTTP/2 установите h2'})")
+
+    async def collect_leg(leg_name: str, routes: List[Tuple[Optional[str], Optional[str]]],
+                          dates: Optional[List[str]], target: Union[FlightsWriter, SpooledList]) -> int:
+        count = 0
+        if routes:
+            async for flights in collect_leg_data(client, routes, date_range=dates, leg_name=leg_name,
+                                                  max_workers=args.workers,
+                                                  fields=None if args.all_fields else FLIGHT_FIELDS,
+                                                  verbose=args.verbose):
+                target.write_items(flights)
+                count += len(flights)
+
+                # Запоминаем промежуточные аэропорты, найденные на первом этапе
+                if leg_name == "leg1":
+                    discovered_airports.update(flight["destination"] for flight in flights
+                                               if flight.get("destination"))
+        return count
 
-    print(f"\nИтого найдено {len(all_flights)} рейс(ов) для этапа {leg_name}\n")
-    return all_flights
+    leg2_spool = SpooledList()
+    tasks = []
+    try:
+        try:
+            # Проверяем коды городов до начала сбора
+            errors = await check_routes(client, [(leg1_routes, leg1_dates), (leg2_routes, leg2_dates)])
+            if errors:
+                raise InvalidRoutesError(errors)
+
+            writer.begin_list("leg1_flights")
+            tasks = [asyncio.ensure_future(collect_leg("leg1", leg1_routes, leg1_dates, writer)),
+                     asyncio.ensure_future(collect_leg("leg2", leg2_routes, leg2_dates, leg2_spool))]
+            leg1_count, leg2_count = await asyncio.gather(*tasks)
+        finally:
+            # При ошибке в одном этапе останавливаем и другой
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if isinstance(client, aiohttp.ClientSession):
+                await client.close()
+            else:
+                await client.aclose()
+        writer.end_list()
+        writer.write_list("leg2_flights", leg2_spool)
+    finally:
+        leg2_spool.close()
 
+    return leg1_count, leg2_count, discovered_airports
 
-def save_data(data: Dict[str, Any], output_file: str):
+
+def positive_int(value: str) -> int:
     """
-    Сохраняет данные в JSON файл.
+    Тип аргумента командной строки: целое число не меньше 1.
 
     Args:
-        data: Данные для сохранения
-        output_file: Путь к выходному файлу
+        value: Значение аргумента
+
+    Returns:
+        Число
+
+    Raises:
+        argparse.ArgumentTypeError: Если значение не целое или меньше 1
     """
-    output_path = Path(output_file)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается целое число, получено {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"значение должно быть не меньше 1, получено {number}")
+    return number
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
-    print(f"\n✓ Данные сохранены в {output_file}")
+def non_negative_float(value: str) -> float:
+    """
+    Тип аргумента командной строки: число не меньше 0.
+
+    Args:
+        value: Значение аргумента
+
+    Returns:
+        Число
+
+    Raises:
+        argparse.ArgumentTypeError: Если значение не число, отрицательное или nan
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается число, получено {value!r}")
+    # Сравнение отсекает и nan
+    if not number >= 0:
+        raise argparse.ArgumentTypeError(f"значение должно быть не меньше 0, получено {value}")
+    return number
 
 
 def main():
@@ -231,10 +1026,36 @@ def main():
                        help="Валюта для цен (по умолчанию RUB)")
 
     parser.add_argument("--output", default=None,
-                       help="Путь к выходному файлу (по умолчанию data/flights_TIMESTAMP.json)")
+                       help="Путь к выходному файлу, для сжатия укажите расширение .json.gz или .json.zst "
+                            "(по умолчанию data/flights_TIMESTAMP.json)")
+
+    parser.add_argument("--workers", type=positive_int, default=MAX_WORKERS,
+                       help=f"Число параллельных запросов к API (по умолчанию {MAX_WORKERS})")
+
+    parser.add_argument("--requests-per-second", type=non_negative_float, default=REQUESTS_PER_SECOND,
+                       help=f"Максимальная частота запросов к API, 0 - без ограничения "
+                            f"(по умолчанию {REQUESTS_PER_SECOND} в секунду)")
+
+    parser.add_argument("--all-fields", action="store_true",
+                       help="Сохранять все поля рейсов из ответа API, а не только используемые при анализе")
+
+    parser.add_argument("--cache-file", default=None,
+                       help="Файл кэша ответов API между запусками, например data/api_cache.sqlite "
+                            "(по умолчанию кэш между запусками не используется)")
+
+    parser.add_argument("--cache-ttl", type=float, default=RESPONSE_CACHE_TTL,
+                       help=f"Время жизни записей в файле кэша (--cache-file) в секундах, "
+                            f"0 - не использовать кэш между запусками "
+                            f"(по умолчанию {RESPONSE_CACHE_TTL})")
+
+    parser.add_argument("--verbose", action="store_true",
+                       help="Выводить результат каждого запроса к API, а не только прогресс сбора")
 
     args = parser.parse_args()
 
+    rate_limiter.set_rate(args.requests_per_second)
+    response_cache.open(args.cache_file, args.cache_ttl)
+
     # Генерируем диапазоны дат
     leg1_dates = get_date_range(args.leg1_dates[0], args.leg1_dates[1])
     leg2_dates = get_date_range(args.leg2_dates[0], args.leg2_dates[1]) if args.leg2_dates else None
@@ -258,59 +1079,30 @@ def main():
         print(f"Второй этап: {len(leg2_dates)} дней ({leg2_dates[0]} - {leg2_dates[-1]})")
     print(f"Валюта: {args.currency}")
 
-    # Сбор данных для первого этапа
-    if args.intermediate:
-        # Старый способ: перебираем указанные промежуточные города
-        leg1_flights = []
-        for intermediate in args.intermediate:
-            flights = collect_leg_data(
-                origin=args.origin,
-                destination=intermediate,
-                date_range=leg1_dates,
-                leg_name="leg1"
-            )
-            leg1_flights.extend(flights)
+    # Определяем имя выходного файла
+    if args.output:
+        output_file = args.output
     else:
-        # Новый способ: получаем все направления из origin
-        leg1_flights = collect_leg_data(
-            origin=args.origin,
-            destination=None,  # Не указываем destination - получим все направления
-            date_range=leg1_dates,
-            leg_name="leg1"
-        )
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        dest_str = args.destination if args.destination else "ALL"
+        output_file = f"data/flights_{args.origin}_{dest_str}_{timestamp}.json"
 
-    # Сбор данных для второго этапа (если нужен)
-    leg2_flights = []
-    if args.destination and leg2_dates:
-        if args.intermediate:
-            # Старый способ: из указанных промежуточных городов в destination
-            for intermediate in args.intermediate:
-                flights = collect_leg_data(
-                    origin=intermediate,
-                    destination=args.destination,
-                    date_range=leg2_dates,
-                    leg_name="leg2"
-                )
-                leg2_flights.extend(flights)
-        else:
-            # Новый способ: все направления в destination
-            leg2_flights = collect_leg_data(
-                origin=None,  # Не указываем origin - получим все направления
-                destination=args.destination,
-                date_range=leg2_dates,
-                leg_name="leg2"
-            )
-
-    # Извлекаем уникальные промежуточные аэропорты из собранных данных
-    discovered_airports = set()
-    for flight in leg1_flights:
-        dest = flight.get("destination")
-        if dest:
-            discovered_airports.add(dest)
-
-    # Формируем итоговые данные
-    result = {
-        "metadata": {
+    # Собираем данные для обоих этапов, сразу записывая рейсы в файл.
+    # Метаданные зависят от собранных рейсов, поэтому задаются после сбора,
+    # но в файле оказываются перед рейсами
+    with FlightsWriter(output_file) as writer:
+        try:
+            leg1_count, leg2_count, discovered_airports = asyncio.run(
+                collect_legs(args, leg1_dates, leg2_dates, writer))
+        except InvalidRoutesError as e:
+            print("\nОшибка: запросы к API отклонены, проверьте коды городов и токен:")
+            for error in e.errors:
+                print(f"  {error}")
+            response_cache.close()
+            # Выход через исключение: незавершенный файл удаляется при выходе из with
+            sys.exit(1)
+
+        metadata = {
             "origin": args.origin,
             "destination": args.destination,
             "intermediate_airports": args.intermediate or sorted(list(discovered_airports)),
@@ -320,36 +1112,27 @@ def main():
             },
             "currency": args.currency,
             "collected_at": datetime.now().isoformat(),
-            "total_flights": len(leg1_flights) + len(leg2_flights)
-        },
-        "leg1_flights": leg1_flights,
-        "leg2_flights": leg2_flights
-    }
-
-    if leg2_dates:
-        result["metadata"]["leg2_date_range"] = {
-            "start": leg2_dates[0],
-            "end": leg2_dates[-1]
+            "total_flights": leg1_count + leg2_count
         }
 
-    # Определяем имя выходного файла
-    if args.output:
-        output_file = args.output
-    else:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        dest_str = args.destination if args.destination else "ALL"
-        output_file = f"data/flights_{args.origin}_{dest_str}_{timestamp}.json"
+        if leg2_dates:
+            metadata["leg2_date_range"] = {
+                "start": leg2_dates[0],
+                "end": leg2_dates[-1]
+            }
 
-    # Сохраняем данные
-    save_data(result, output_file)
+        writer.write_header_value("metadata", metadata)
+
+    response_cache.close()
+    print(f"\n✓ Данные сохранены в {output_file}")
 
     print(f"\n{'='*60}")
     print("СБОР ДАННЫХ ЗАВЕРШЕН")
     print(f"{'='*60}")
-    print(f"Первый этап: {len(leg1_flights)} рейсов")
-    if leg2_flights:
-        print(f"Второй этап: {len(leg2_flights)} рейсов")
-    print(f"Всего: {len(leg1_flights) + len(leg2_flights)} рейсов")
+    print(f"Первый этап: {leg1_count} рейсов")
+    if leg2_count:
+        print(f"Второй этап: {leg2_count} рейсов")
+    print(f"Всего: {leg1_count + leg2_count} рейсов")
     if discovered_airports:
         print(f"Найдено направлений: {len(discovered_airports)}")
     print(f"Файл: {output_file}")
@@ -0,0 +1,106 @@
+"""Тесты поиска комбинаций перелетов в aggregate_flights.py."""
+
+import random
+
+import pytest
+
+import aggregate_flights as ag
+
+SCANNERS = [ag.scan_pairs, ag.scan_pairs_numpy]
+if ag.numba is not None:
+    SCANNERS.append(ag.scan_pairs_jit)
+
+ALLOWED_BY_CITY = {"IST": {"IST"}}
+
+
+def make_flight(departure_at, arrival_at=None, origin="MOW", destination="IST", price=100):
+    flight = {"origin": origin, "destination": destination, "departure_at": departure_at, "price": price}
+    if arrival_at:
+        flight["arrival_at"] = arrival_at
+    return ag.normalize_flight(flight)
+
+
+def expected_hits(leg1_flights, leg2_flights, min_stay, max_stay):
+    """Перебор всех пар с длительностью пребывания из calculate_stay_duration."""
+    hits = []
+    for index1, flight1 in enumerate(leg1_flights):
+        for index2, flight2 in enumerate(leg2_flights):
+            stay_days = ag.calculate_stay_duration(flight1.arrival_at, flight2.departure_at)
+            if min_stay <= stay_days <= max_stay:
+                hits.append((flight1.price + flight2.price, index1, index2, stay_days))
+    return sorted(hits)
+
+
+@pytest.mark.parametrize("scan", SCANNERS)
+def test_utc_pair_counts_stay_by_time(scan):
+    leg1 = [make_flight("2026-02-12T08:00:00Z", "2026-02-12T10:15:00Z")]
+    leg2 = [make_flight("2026-02-13T07:45:00Z", origin="IST", destination="BKK")]
+
+    assert ag.calculate_stay_duration(leg1[0].arrival_at, leg2[0].departure_at) == 0
+    assert scan(leg1, leg2, ALLOWED_BY_CITY, 0, 5) == [(200, 0, 0, 0)]
+    assert scan(leg1, leg2, ALLOWED_BY_CITY, 1, 5) == []
+
+
+@pytest.mark.parametrize("scan", SCANNERS)
+def test_mixed_timestamps_match_calculate_stay_duration(scan):
+    rnd = random.Random(1)
+    formats = ["2026-02-{day:02d}T{hour:02d}:{minute:02d}:00Z",
+               "2026-02-{day:02d}T{hour:02d}:{minute:02d}:00+03:00",
+               "2026-02-{day:02d}T{hour:02d}:{minute:02d}:00",
+               "2026-02-{day:02d}",
+               "bad"]
+
+    def random_time():
+        return rnd.choice(formats).format(day=rnd.randint(1, 27), hour=rnd.randint(0, 23),
+                                          minute=rnd.choice([0, 15, 45]))
+
+    leg1 = [make_flight("2026-02-01T00:00:00", random_time(), price=rnd.randint(1, 999)) for _ in range(80)]
+    leg2 = [make_flight(random_time(), origin="IST", destination="BKK", price=rnd.randint(1, 999))
+            for _ in range(80)]
+
+    assert sorted(scan(leg1, leg2, ALLOWED_BY_CITY, 1, 5)) == expected_hits(leg1, leg2, 1, 5)
+
+
+@pytest.mark.parametrize("scan", SCANNERS)
+def test_all_utc_timestamps_match_calculate_stay_duration(scan):
+    rnd = random.Random(2)
+
+    def random_time():
+        return f"2026-02-{rnd.randint(1, 27):02d}T{rnd.randint(0, 23):02d}:{rnd.choice([0, 15, 45]):02d}:00Z"
+
+    leg1 = [make_flight("2026-02-01T00:00:00Z", random_time(), price=rnd.randint(1, 999)) for _ in range(50)]
+    leg2 = [make_flight(random_time(), origin="IST", destination="BKK", price=rnd.randint(1, 999))
+            for _ in range(50)]
+
+    assert sorted(scan(leg1, leg2, ALLOWED_BY_CITY, 1, 5)) == expected_hits(leg1, leg2, 1, 5)
+
+
+def test_top_zero_still_prints_statistics(capsys):
+    leg1 = [make_flight("2026-02-01T08:00:00", "2026-02-01T12:00:00", price=price) for price in (100, 200)]
+    leg2 = [make_flight("2026-02-05T08:00:00", origin="IST", destination="BKK", price=50)]
+    data = {"leg1_flights": [flight._asdict() for flight in leg1],
+            "leg2_flights": [flight._asdict() for flight in leg2]}
+
+    combinations, stats = ag.find_combinations(data, top_n=0)
+    ag.print_summary(combinations, stats, top_n=0)
+
+    output = capsys.readouterr().out
+    assert combinations == []
+    assert "Найдено комбинаций: 2" in output
+    assert "ТОП-0" in output
+    assert "Не найдено подходящих комбинаций" not in output
+
+
+def test_statistics_over_hits():
+    leg1 = [make_flight("2026-02-01", destination=city) for city in ("IST", "DXB", "IST")]
+    hits = [(300, 0, 0, 2), (100, 1, 0, 3), (250, 2, 1, 4), (500, 0, 2, 5)]
+
+    stats = ag.get_statistics(hits, leg1)
+
+    assert stats["total_combinations"] == 4
+    assert (stats["min_price"], stats["max_price"], stats["median_price"]) == (100, 500, 300)
+    assert stats["avg_price"] == 287.5
+    assert stats["by_intermediate_city"] == {
+        "IST": {"count": 3, "min_price": 250, "avg_price": 350.0},
+        "DXB": {"count": 1, "min_price": 100, "avg_price": 100.0}
+    }
@@ -0,0 +1,99 @@
+"""Тесты построения сети аэропортов в build_airport_network.py."""
+
+import json
+import random
+
+import numpy as np
+import pytest
+
+import build_airport_network as ban
+
+# Поиск пар: через BallTree, через окно по широте (без scikit-learn) и numba ядром
+FIND_PAIRS = ["numpy", "numpy_window"]
+if ban.numba is not None:
+    FIND_PAIRS.append("jit")
+
+
+def make_airports(n=400, seed=3):
+    """Аэропорты группами вокруг случайных центров, включая полюс и линию смены дат."""
+    rnd = random.Random(seed)
+    centers = [(rnd.uniform(-70, 75), rnd.uniform(-180, 180)) for _ in range(n // 20)]
+    centers += [(89.6, 10.0), (0.0, 179.95)]
+    airports = []
+    for k in range(n):
+        lat, lon = rnd.choice(centers)
+        lat = max(-90.0, min(90.0, lat + rnd.gauss(0, 0.6)))
+        lon = (lon + rnd.gauss(0, 0.6) + 180) % 360 - 180
+        airports.append({"iata_code": f"A{k:03d}", "coordinates": f"{lat:.6f}, {lon:.6f}",
+                         "name": f"Аэропорт {k}", "municipality": f"Город {k % 37}", "iso_country": "RU"})
+    # Некорректные записи пропускаются
+    airports.append({"iata_code": "BAD", "coordinates": "bad", "name": "", "municipality": "", "iso_country": ""})
+    airports.append({"iata_code": "", "coordinates": "1.0, 2.0", "name": "", "municipality": "", "iso_country": ""})
+    return airports
+
+
+def expected_network(airports, max_distance_km):
+    """Сеть, построенная перебором всех пар через haversine_distance, как до векторизации."""
+    coords = {}
+    for airport in airports:
+        lat, lon = ban.parse_coordinates(airport["coordinates"])
+        if airport["iata_code"] and lat is not None:
+            coords[airport["iata_code"]] = (airport, lat, lon)
+
+    network = {}
+    for iata1, (airport, lat1, lon1) in coords.items():
+        nearby = []
+        for iata2, (_, lat2, lon2) in coords.items():
+            if iata1 != iata2:
+                distance = ban.haversine_distance(lat1, lon1, lat2, lon2)
+                if distance <= max_distance_km:
+                    nearby.append({"iata": iata2, "distance_km": round(distance, 2)})
+        nearby.sort(key=lambda x: x["distance_km"])
+        network[iata1] = {"name": airport["name"], "municipality": airport["municipality"],
+                          "country": airport["iso_country"], "coordinates": airport["coordinates"],
+                          "nearby_airports": nearby}
+    return network
+
+
+@pytest.mark.parametrize("method", FIND_PAIRS)
+@pytest.mark.parametrize("max_distance_km", [0.5, 100.0, 150.0])
+def test_find_pairs_match_brute_force(monkeypatch, method, max_distance_km):
+    if method == "numpy_window":
+        monkeypatch.setattr(ban, "BallTree", None)
+    find_pairs = ban.find_pairs_jit if method == "jit" else ban.find_pairs_numpy
+    points = [ban.parse_coordinates(airport["coordinates"]) for airport in make_airports()[:-2]]
+    lats = np.radians([lat for lat, _ in points])
+    lons = np.radians([lon for _, lon in points])
+
+    pair_i, pair_j, distances = find_pairs(lats, lons, np.cos(lats), max_distance_km)
+
+    expected = [(i, j, ban.haversine_distance(*points[i], *points[j]))
+                for i in range(len(points)) for j in range(i + 1, len(points))
+                if ban.haversine_distance(*points[i], *points[j]) <= max_distance_km]
+    assert expected
+    assert list(zip(pair_i.tolist(), pair_j.tolist())) == [(i, j) for i, j, _ in expected]
+    assert distances.tolist() == pytest.approx([d for _, _, d in expected], rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_save_network_matches_json_dump(monkeypatch, tmp_path, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(ban, "orjson", None)
+    airports = make_airports()
+    output_file = tmp_path / "airport_network.json"
+
+    ban.save_network(ban.build_airport_network(airports, max_distance_km=100), output_file=str(output_file))
+
+    assert output_file.read_bytes() == json.dumps(
+        expected_network(airports, 100), ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def test_parquet_round_trip(tmp_path):
+    network = ban.build_airport_network(make_airports(), max_distance_km=100)
+    iatas = list(network)
+
+    ban.save_network_parquet(network, output_dir=str(tmp_path))
+    loaded = ban.load_network_parquet(str(tmp_path))
+
+    assert loaded == {iata: ban.airport_record(info, iatas) for iata, info in network.items()}
+    assert list(loaded) == iatas
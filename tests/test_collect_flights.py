@@ -0,0 +1,230 @@
+"""Тесты сбора и записи перелетов в collect_flights.py."""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("TRAVELPAYOUTS_TOKEN", "test")
+
+import collect_flights as cf
+
+METADATA = {"origin": "MOW", "intermediate": ["IST", "DXB"], "collected_at": "2026-02-01T10:00:00"}
+LEG1 = [{"origin": "MOW", "destination": "IST", "price": 12000, "departure_at": "2026-02-01T08:00:00+03:00",
+         "airline": "TK", "note": "Стамбул"},
+        {"origin": "MOW", "destination": "DXB", "price": 15500.5, "departure_at": "2026-02-02T09:30:00+03:00",
+         "transfers": 0}]
+LEG2 = [{"origin": "IST", "destination": "BKK", "price": 30000, "departure_at": "2026-02-05T01:00:00+03:00"}]
+
+
+@pytest.fixture(autouse=True)
+def isolated_api(monkeypatch):
+    """Отдельный кэш ответов и ограничитель частоты без ожидания для каждого теста."""
+    monkeypatch.setattr(cf, "response_cache", cf.ResponseCache())
+    monkeypatch.setattr(cf, "rate_limiter", cf.RateLimiter(0))
+
+
+def expected_bytes(data):
+    """Результат записи всего словаря через json.dumps, как до потоковой записи."""
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def write_flights(output_file, leg2=LEG2):
+    with cf.FlightsWriter(str(output_file)) as writer:
+        writer.begin_list("leg1_flights")
+        writer.write_items(LEG1[:1])
+        writer.write_items(LEG1[1:])
+        writer.end_list()
+        writer.begin_list("leg2_flights")
+        writer.write_items(leg2)
+        writer.end_list()
+        writer.write_header_value("metadata", METADATA)
+
+
+def read_output(output_file):
+    """Читает результат, распаковывая .gz и .zst."""
+    raw = output_file.read_bytes()
+    if output_file.suffix == ".gz":
+        return gzip.decompress(raw)
+    if output_file.suffix == ".zst":
+        return cf.zstandard.ZstdDecompressor().stream_reader(raw).read()
+    return raw
+
+
+@pytest.mark.parametrize("name", ["flights.json", "flights.json.gz", "flights.json.zst"])
+def test_writer_matches_json_dump(tmp_path, name):
+    if name.endswith(".zst") and cf.zstandard is None:
+        pytest.skip("zstandard не установлен")
+    output_file = tmp_path / name
+
+    write_flights(output_file)
+
+    assert read_output(output_file) == expected_bytes(
+        {"metadata": METADATA, "leg1_flights": LEG1, "leg2_flights": LEG2})
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_writer_matches_json_dump_with_empty_list(tmp_path):
+    output_file = tmp_path / "flights.json"
+
+    write_flights(output_file, leg2=[])
+
+    assert output_file.read_bytes() == expected_bytes(
+        {"metadata": METADATA, "leg1_flights": LEG1, "leg2_flights": []})
+
+
+def test_check_routes_reports_rejected_codes(monkeypatch):
+    requests = []
+
+    async def fake_get_async(client, params):
+        requests.append(params)
+        if params.get("origin") == "MWO":
+            return 400, None, b'{"error": "invalid origin"}'
+        return 200, None, b'{"data": []}'
+
+    monkeypatch.setattr(cf, "get_async", fake_get_async)
+    legs = [([("MWO", "IST"), ("MOW", "IST"), ("MOW", "ИСТ")], ["2026-02-01"])]
+
+    errors = asyncio.run(cf.check_routes(None, legs))
+
+    assert len(errors) == 2
+    assert errors[0].startswith("ИСТ: ")
+    assert errors[1].startswith("MWO -> IST: HTTP 400")
+    assert "invalid origin" in errors[1]
+    # Код не из латинских букв отклоняется без запроса к API
+    assert all("ИСТ" not in params.values() for params in requests)
+    assert len(requests) == 2
+
+
+@pytest.mark.parametrize("value", ["0", "-2", "1.5", "x"])
+def test_workers_below_one_rejected(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        cf.positive_int(value)
+
+
+@pytest.mark.parametrize("value", ["-1", "nan", "x"])
+def test_negative_requests_per_second_rejected(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        cf.non_negative_float(value)
+
+
+def test_argument_types_accept_valid_values():
+    assert cf.positive_int("8") == 8
+    assert cf.non_negative_float("0") == 0.0
+    assert cf.non_negative_float("2.5") == 2.5
+
+
+def test_response_cache_keeps_only_probe_responses_in_memory():
+    cache = cf.ResponseCache()
+    probe, other = {"origin": "MOW", "token": "a"}, {"origin": "IST", "token": "a"}
+
+    cache.put(probe, b"probe", keep_in_memory=True)
+    cache.put(other, b"other")
+
+    assert cache.get(other) is None
+    # Токен не входит в ключ, ответ отдается один раз
+    assert cache.get({"origin": "MOW", "token": "b"}) == b"probe"
+    assert cache.get(probe) is None
+
+
+def test_response_cache_file_is_written_on_close(tmp_path):
+    cache_file = tmp_path / "cache.sqlite"
+    cache = cf.ResponseCache()
+    cache.open(str(cache_file), ttl=60)
+    cache.put({"origin": "MOW"}, b"body")
+    cache.close()
+
+    cache.open(str(cache_file), ttl=60)
+    assert cache.get({"origin": "MOW"}) == b"body"
+    cache.close()
+
+
+def test_response_cache_without_file_is_memory_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = cf.ResponseCache()
+    cache.open(None, ttl=60)
+    cache.put({"origin": "MOW"}, b"body")
+    cache.close()
+
+    assert cache.get({"origin": "MOW"}) is None
+    assert not list(tmp_path.iterdir())
+
+
+async def collect_all(routes, dates, **kwargs):
+    """Собирает все порции рейсов этапа в список."""
+    return [flights async for flights in cf.collect_leg_data(None, routes, dates, "leg1", fields=None, **kwargs)]
+
+
+def test_collect_leg_data_yields_in_request_order(monkeypatch):
+    routes = [("MOW", "IST"), ("MOW", "DXB")]
+    dates = ["2026-02-01", "2026-02-02", "2026-02-03"]
+
+    async def fake_get_async(client, params):
+        # Поздние даты отвечают раньше ранних
+        await asyncio.sleep(0.01 * (4 - int(params["departure_at"][-1])))
+        flight = {"origin": params["origin"], "destination": params["destination"],
+                  "departure_at": params["departure_at"]}
+        return 200, None, json.dumps({"data": [flight]}).encode()
+
+    monkeypatch.setattr(cf, "get_async", fake_get_async)
+
+    batches = asyncio.run(collect_all(routes, dates, max_workers=4))
+
+    assert [(flights[0]["destination"], flights[0]["departure_at"]) for flights in batches] == [
+        (destination, date) for (_, destination) in routes for date in dates]
+    assert all(flights[0]["search_date"] == flights[0]["departure_at"] for flights in batches)
+
+
+def test_collect_leg_data_worker_error_ends_run(monkeypatch):
+    async def fake_get_async(client, params):
+        if params["departure_at"] == "2026-02-02":
+            raise RuntimeError("сбой обработчика")
+        return 200, None, b'{"data": []}'
+
+    monkeypatch.setattr(cf, "get_async", fake_get_async)
+    dates = [f"2026-02-{day:02d}" for day in range(1, 21)]
+
+    with pytest.raises(RuntimeError, match="сбой обработчика"):
+        asyncio.run(asyncio.wait_for(collect_all([("MOW", "IST")], dates, max_workers=2), timeout=5))
+
+
+def test_rate_limiter_spaces_requests_after_burst():
+    limiter = cf.RateLimiter(20, burst=2)
+
+    async def wait_all():
+        start = time.monotonic()
+        for _ in range(6):
+            await limiter.wait_async()
+        return time.monotonic() - start
+
+    # Два запроса проходят сразу, остальные четыре - с интервалом 1/20 с
+    assert 0.18 <= asyncio.run(wait_all()) < 1.0
+
+
+def test_retry_delay_honours_retry_after():
+    assert cf.retry_delay(0, "3") >= 3
+    assert cf.retry_delay(0, "100") == cf.RETRY_MAX_DELAY
+    assert cf.retry_delay(0, "Wed, 21 Oct 2026 07:28:00 GMT") <= 2 * cf.RETRY_BACKOFF
+
+
+def test_fetch_waits_for_retry_after(monkeypatch):
+    monkeypatch.setattr(cf, "RETRY_BACKOFF", 0.01)
+    calls = []
+
+    async def fake_get_async(client, params):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return 429, "0.3", b""
+        return 200, None, b'{"data": [{"price": 100}]}'
+
+    monkeypatch.setattr(cf, "get_async", fake_get_async)
+
+    result = asyncio.run(cf.fetch_flights_async(None, "MOW", "IST", "2026-02-01"))
+
+    assert result == {"data": [{"price": 100}]}
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.3